@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_asgi_application()
+
+# Build the signup email filter off the request path as the worker starts
+from core.emailfilter import email_filter  # noqa: E402
+
+email_filter.start()
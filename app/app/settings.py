@@ -46,17 +46,44 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.staticfiles.StaticFilesMiddleware",
+    "core.traffic.TrafficCaptureMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.profiling.RequestProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
 ROOT_URLCONF = "app.urls"
 
+# Traffic capture
+# Share of requests (0 to 1) recorded as anonymized traces for replay with
+# the replay_traffic command. Capture is off unless this is set. Each worker
+# writes its own file, TRAFFIC_CAPTURE_FILE with its process id added, e.g.
+# capture.1234.jsonl; pass them all to replay_traffic.
+
+TRAFFIC_CAPTURE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_RATE", 0))
+TRAFFIC_CAPTURE_FILE = os.environ.get(
+    "TRAFFIC_CAPTURE_FILE", BASE_DIR / "traffic" / "capture.jsonl"
+)
+TRAFFIC_CAPTURE_MAX_BYTES = 10 * 1024 * 1024
+TRAFFIC_CAPTURE_BACKUP_COUNT = 5
+
+# Request profiling
+# Staff, or callers with a header from core.profiling.sign_profile_request,
+# can profile a single request by sending X-Profile. Results are listed in
+# the admin and their folded stacks are kept in REQUEST_PROFILE_DIR.
+
+REQUEST_PROFILING = True
+REQUEST_PROFILE_DIR = BASE_DIR / "profiles"
+REQUEST_PROFILE_INTERVAL = 0.001
+REQUEST_PROFILE_MAX_CONCURRENT = 2
+REQUEST_PROFILE_SIGNATURE_MAX_AGE = 60 * 60
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -89,6 +116,59 @@ DATABASES = {
     }
 }
 
+# User sharding
+# Users and their tokens are spread across USER_SHARDS by a stable hash of
+# the normalized email. Extra shards are named in DB_SHARDS, e.g.
+# DB_SHARDS=users1,users2, and live on the same server as default.
+# DB_SHARD_ENGINE=sqlite keeps each shard in a local file instead, so the
+# sharding layer can be exercised without extra Postgres databases (run
+# core.tests.test_sharding alone then, see its docstring).
+# The directory mapping user ids to shards always lives on default.
+# The admin reads users through the default database only, so with more
+# than one shard it lists and edits just the users stored on default;
+# use sharding.get_user() and move_user for the others.
+
+USER_SHARDS = ["default"]
+USER_SHARD_DIRECTORY = "default"
+
+for shard in filter(None, os.environ.get("DB_SHARDS", "").split(",")):
+    if os.environ.get("DB_SHARD_ENGINE") == "sqlite":
+        DATABASES[shard] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / f"{shard}.sqlite3",
+        }
+    else:
+        DATABASES[shard] = dict(DATABASES["default"], NAME=shard)
+    USER_SHARDS.append(shard)
+
+DATABASE_ROUTERS = ["core.routers.UserShardRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# A bounded in-process L1 in front of a shared L2. The file based L2 is a
+# stand-in for a shared cache server and can be swapped for one without
+# touching callers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "core.cache.TieredCache",
+        "LOCATION": "tiered",
+        "OPTIONS": {
+            "L2": "shared",
+            "L1_MAX_ENTRIES": 10000,
+            "L1_TIMEOUT": 5,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CACHE_DIR", "/tmp/app-cache"),
+    },
+}
+
+# How long a token or shard lookup may be served from the cache
+AUTH_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -98,10 +178,15 @@ AUTH_PASSWORD_VALIDATORS = [
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
     },
     {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",},
-    {"NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",},
+    {"NAME": "core.passwords.BreachedPasswordValidator",},
     {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",},
 ]
 
+# Memory-mapped index of breached passwords, built with the
+# build_password_index command
+
+BREACHED_PASSWORDS_INDEX = BASE_DIR / "data" / "breached-passwords.idx"
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
@@ -121,6 +206,11 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = "/static/"
+STATIC_ROOT = os.environ.get("STATIC_ROOT", BASE_DIR / "staticfiles")
+
+# collectstatic stores content hashed, precompressed files that
+# core.staticfiles.StaticFilesMiddleware serves when DEBUG is off
+STATICFILES_STORAGE = "core.staticfiles.CompressedManifestStaticFilesStorage"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -129,6 +219,36 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "core.User"
 
+AUTHENTICATION_BACKENDS = ["core.backends.ShardedModelBackend"]
+
+# Email filter
+# Signups skip the email uniqueness query when an in-memory Bloom filter
+# says the email is new. Sized for at least EMAIL_FILTER_CAPACITY users at
+# EMAIL_FILTER_ERROR_RATE false positives, with room for EMAIL_FILTER_HEADROOM
+# more users than there are, and rebuilt once signups use up that room.
+
+EMAIL_FILTER_ENABLED = True
+EMAIL_FILTER_CAPACITY = 1_000_000
+EMAIL_FILTER_ERROR_RATE = 0.001
+EMAIL_FILTER_HEADROOM = 0.2
+
+# Batch requests
+# /api/batch/ runs up to BATCH_MAX_REQUESTS user API requests in one round
+# trip and stops running them after BATCH_MAX_CPU_TIME seconds of CPU.
+
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_CPU_TIME = 2.0
+
+# User change feed
+# Readers wait USER_CHANGES_SETTLE_SECONDS for a change id that may still
+# be committing, long polls wait at most USER_CHANGES_MAX_WAIT seconds and
+# compaction keeps only the latest entry per user after the retention.
+
+USER_CHANGES_SETTLE_SECONDS = 5
+USER_CHANGES_MAX_WAIT = 30
+USER_CHANGES_MAX_PAGE_SIZE = 1000
+USER_CHANGES_RETENTION_DAYS = 7
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
\ No newline at end of file
@@ -21,10 +21,16 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from core.views import BatchView, CacheStatsView, UserChangesView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='api-schema'),
          name='api-docs'),
     path('api/user/', include('user.urls')),
+    path('api/batch/', BatchView.as_view(), name='batch'),
+    path('api/cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('api/user-changes/', UserChangesView.as_view(),
+         name='user-changes'),
 ]
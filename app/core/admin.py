@@ -2,6 +2,9 @@
 Django admin customisation
 """
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
 # Importing UserAdmin as BaseUserAdmin so we can call our custom
 # user admin as UserAdmin
@@ -30,9 +33,9 @@ class UserAdmin(BaseUserAdmin):
                 "is_staff",
                 "is_superuser",
             )}),
-        (_("Important dates"), {"fields": ("last_login",)}),
+        (_("Important dates"), {"fields": ("last_login", "updated_at")}),
     )
-    readonly_fields = ["last_login"]
+    readonly_fields = ["last_login", "updated_at"]
     add_fieldsets = (
         (
             None,
@@ -52,6 +55,66 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Define the admin pages for request profiles"""
+
+    list_display = [
+        "created", "method", "path", "status", "duration_ms", "query_count",
+    ]
+    list_filter = ["method", "status"]
+    search_fields = ["path", "user_email"]
+    fields = [
+        "created", "user_email", "method", "path", "status", "duration_ms",
+        "sample_count", "query_count", "query_time_ms", "stacks",
+        "summary_text",
+    ]
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        # Profiles are only ever recorded by the middleware
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        """Add a download view for the folded stacks."""
+        urls = [
+            path(
+                "<int:pk>/stacks/",
+                self.admin_site.admin_view(self.stacks_view),
+                name="core_requestprofile_stacks",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def stacks_view(self, request, pk):
+        """Serve the folded stacks of a profile as a file."""
+        profile = self.get_object(request, pk)
+        if profile is None or not self.has_view_permission(request, profile):
+            raise Http404
+        try:
+            stacks = open(profile.stacks_file, "rb")
+        except OSError:
+            raise Http404(_("Stacks file is no longer available."))
+        return FileResponse(
+            stacks,
+            as_attachment=True,
+            filename=f"profile-{profile.pk}.folded",
+            content_type="text/plain",
+        )
+
+    @admin.display(description=_("Flamegraph stacks"))
+    def stacks(self, obj):
+        url = reverse("admin:core_requestprofile_stacks", args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, _("Download"))
+
+    @admin.display(description=_("Summary"))
+    def summary_text(self, obj):
+        return format_html("<pre>{}</pre>", obj.summary)
+
+
 # Load the models in to the admin page
 # Register User using our custom UserAdmin
 admin.site.register(models.User, UserAdmin)
+admin.site.register(models.RequestProfile, RequestProfileAdmin)
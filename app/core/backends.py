@@ -0,0 +1,126 @@
+"""
+Authentication backends aware of user sharding.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core import sharding
+from core.cache import versioned_key
+
+
+def token_cache_key(key):
+    return versioned_key("auth", f"token:{key}")
+
+
+def forget_tokens(user):
+    """Drop the cached token locations of a user that moved."""
+    tokens = Token.objects.using(user._state.db).filter(user=user)
+    for key in tokens.values_list("key", flat=True):
+        cache.delete(token_cache_key(key))
+
+
+class ShardedModelBackend(ModelBackend):
+    """Authenticate users against the shard that holds them"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        """Look the user up on its shard and check the password."""
+        if username is None:
+            username = kwargs.get("email")
+        if username is None or password is None:
+            return None
+        try:
+            user = sharding.get_user_by_email(username)
+        except get_user_model().DoesNotExist:
+            # Run the hasher anyway to keep timing the same as a bad
+            # password, as ModelBackend does
+            get_user_model()().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        """Return the user with this id from its shard."""
+        try:
+            user = sharding.get_user(user_id)
+        except get_user_model().DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+class ShardedTokenAuthentication(TokenAuthentication):
+    """Token authentication that finds tokens on any shard"""
+
+    def authenticate_credentials(self, key):
+        """Return the user and token for a key held on any shard.
+
+        Only where the token lives is cached, as (user id, shard). The
+        token and its user are read fresh from that shard, so changes and
+        deletes are seen at once.
+        """
+        cache_key = token_cache_key(key)
+        location = cache.get_or_set(
+            cache_key,
+            lambda: self.locate_token(key),
+            settings.AUTH_CACHE_TIMEOUT,
+        )
+        token = None
+        if location is not None:
+            user_id, shard = location
+            token = self.get_token(key, shard, user_id=user_id)
+            if token is None:
+                # Moved since it was cached, so look everywhere once more
+                cache.delete(cache_key)
+                token = self.find_token(key)
+                if token is not None:
+                    cache.set(
+                        cache_key,
+                        (token.user_id, token._state.db),
+                        settings.AUTH_CACHE_TIMEOUT,
+                    )
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+
+        return (token.user, token)
+
+    def get_token(self, key, shard, **filters):
+        """Return the token with its user from one shard, if it is there."""
+        return (
+            Token.objects.using(shard)
+            .select_related("user")
+            .filter(key=key, **filters)
+            .first()
+        )
+
+    def find_token(self, key):
+        """Return the token with its user from whichever shard holds it."""
+        for shard in sharding.get_shards():
+            token = self.get_token(key, shard)
+            if token is not None:
+                return token
+        return None
+
+    def locate_token(self, key):
+        """Return the user id and shard of a token, or None."""
+        for shard in sharding.get_shards():
+            user_id = (
+                Token.objects.using(shard)
+                .filter(key=key)
+                .values_list("user_id", flat=True)
+                .first()
+            )
+            if user_id is not None:
+                return (user_id, shard)
+        return None
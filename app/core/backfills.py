@@ -0,0 +1,34 @@
+"""
+Backfills run by the backfill command.
+
+Register a Backfill from core.online here when a migration adds a column
+that existing rows need filled in, e.g.
+
+    register(Backfill(
+        "user-nickname",
+        "core.User",
+        values={"nickname": F("name")},
+        condition=Q(nickname__isnull=True),
+    ))
+"""
+from django.db.models import Q
+from django.db.models.functions import Now
+
+from core.online import Backfill
+
+BACKFILLS = {}
+
+
+def register(backfill):
+    """Make a backfill available to the backfill command."""
+    BACKFILLS[backfill.name] = backfill
+    return backfill
+
+
+# Users saved before updated_at was added count as updated when filled
+register(Backfill(
+    "user-updated-at",
+    "core.User",
+    values={"updated_at": Now()},
+    condition=Q(updated_at__isnull=True),
+))
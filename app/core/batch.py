@@ -0,0 +1,207 @@
+"""
+Batches of user API requests.
+
+Clients typically get a token, read /me/ and then update it, paying a
+round trip and an authentication for each. run_batch() runs such a list
+of requests against the user API within one HTTP request:
+
+* the caller is authenticated once for the whole batch, and a token
+  obtained by a request in the batch authenticates the requests after it,
+* with atomic set the requests share one transaction on every database
+  they can write to (each user shard and the shard directory), and the
+  first failure rolls all of them back and skips the rest; tokens
+  obtained in a rolled back batch are left out of its results. The
+  databases commit one after another, so only a failure during commit
+  itself can leave part of a batch behind,
+* every request gets its own status and body in the results,
+* once the batch has used settings.BATCH_MAX_CPU_TIME seconds of CPU the
+  remaining requests are not run.
+
+Only paths in the user URLconf can be batched.
+"""
+import io
+import json
+import logging
+import time
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+from rest_framework import status
+
+from core import sharding
+from core.backends import ShardedTokenAuthentication
+
+logger = logging.getLogger(__name__)
+
+# URL namespace whose views can be batched
+BATCH_NAMESPACE = "user"
+
+# Request metadata passed on from the batch to each of its requests
+INHERITED_META = (
+    "REMOTE_ADDR",
+    "SERVER_NAME",
+    "SERVER_PORT",
+    "SERVER_PROTOCOL",
+    "HTTP_HOST",
+    "HTTP_USER_AGENT",
+    "HTTP_ACCEPT_LANGUAGE",
+)
+
+
+class BatchedRequest(HttpRequest):
+    """A request of a batch, built from the batch request"""
+
+    def __init__(self, parent, method, path, body=None):
+        super().__init__()
+        url = urlsplit(path)
+        self._scheme = parent.scheme
+        self.method = method
+        self.path = self.path_info = url.path
+        self.META = {
+            key: parent.META[key] for key in INHERITED_META
+            if key in parent.META
+        }
+        data = b"" if body is None else json.dumps(body).encode()
+        self.META.update({
+            "QUERY_STRING": url.query,
+            "HTTP_ACCEPT": "application/json",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(data)),
+        })
+        self._set_content_type_params(self.META)
+        self.GET = QueryDict(url.query)
+        self._stream = io.BytesIO(data)
+        self._read_started = False
+
+    def _get_scheme(self):
+        return self._scheme
+
+    def force_authenticate(self, user, token):
+        # DRF uses these instead of running its authenticators again
+        self._force_auth_user = user
+        self._force_auth_token = token
+
+
+def resolve_batched(path):
+    """Return the URL match of a path, or None if it cannot be batched."""
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return None
+    if match.namespace != BATCH_NAMESPACE:
+        return None
+    return match
+
+
+def response_body(response):
+    """Return the decoded body of a response."""
+    if not response.content:
+        return None
+    if response.get("Content-Type", "").startswith("application/json"):
+        return json.loads(response.content)
+    return response.content.decode(response.charset)
+
+
+def run_request(request, match):
+    """Run one batched request and return its status and body."""
+    request.resolver_match = match
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+    except Exception:
+        logger.exception("Batched request to %s failed", request.path)
+        return (
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            {"detail": "A server error occurred."},
+        )
+    return response.status_code, response_body(response)
+
+
+def token_user(body):
+    """Return the user and token of a token response, if it holds one."""
+    # Read without the token cache, as an atomic batch may yet roll back
+    try:
+        token = ShardedTokenAuthentication().find_token(body["token"])
+    except (KeyError, TypeError):
+        return None, None
+    if token is None or not token.user.is_active:
+        return None, None
+    return token.user, token
+
+
+def batch_databases(user):
+    """Return the databases the requests of a batch can write to."""
+    if not sharding.is_sharded():
+        return [router.db_for_write(get_user_model(), instance=user)]
+    # The same order in every batch, so batches do not deadlock
+    directory = sharding.directory_db()
+    return [directory] + [
+        shard for shard in sharding.get_shards() if shard != directory
+    ]
+
+
+def run_batch(request, items, atomic=False):
+    """Run batched requests in order and return their results."""
+    user = request.user if request.user.is_authenticated else None
+    token = request.auth
+    databases = batch_databases(user) if atomic else []
+
+    results = []
+    stopped = None
+    cpu_time = 0.0
+    with ExitStack() as stack:
+        for using in databases:
+            stack.enter_context(transaction.atomic(using=using))
+        for item in items:
+            if stopped is None and cpu_time >= settings.BATCH_MAX_CPU_TIME:
+                stopped = (
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "Not run: the batch used up its CPU time.",
+                )
+            if stopped is not None:
+                code, detail = stopped
+                results.append({"status": code, "body": {"detail": detail}})
+                continue
+
+            match = resolve_batched(item["path"])
+            if match is None:
+                code = status.HTTP_404_NOT_FOUND
+                body = {"detail": "Not found."}
+            else:
+                batched = BatchedRequest(
+                    request, item["method"], item["path"], item.get("body")
+                )
+                if user is not None:
+                    batched.force_authenticate(user, token)
+                started = time.thread_time()
+                code, body = run_request(batched, match)
+                cpu_time += time.thread_time() - started
+            results.append({"status": code, "body": body})
+
+            if atomic and code >= 400:
+                stopped = (
+                    status.HTTP_424_FAILED_DEPENDENCY,
+                    "Not run: an earlier request in the batch failed.",
+                )
+            elif (
+                user is None and code == status.HTTP_200_OK
+                and match.url_name == "token"
+            ):
+                user, token = token_user(body)
+
+        rolled_back = atomic and stopped is not None
+        if rolled_back:
+            for using in databases:
+                transaction.set_rollback(True, using=using)
+            for result in results:
+                if isinstance(result["body"], dict):
+                    result["body"].pop("token", None)
+
+    return {"results": results, "rolled_back": rolled_back}
@@ -0,0 +1,344 @@
+"""
+Two tier cache backend with stampede protection.
+
+TieredCache keeps a small, short lived in-process L1 in front of a shared
+L2, which is any other configured cache alias (a file based cache by
+default). On top of the usual cache API, get_or_set:
+
+* computes a missing value once per key per process, and takes a short
+  lease so other processes wait for the value instead of all recomputing
+  it (single-flight). With a file based L2 the lease is a lock file
+  created with O_EXCL, as FileBasedCache.add() is not atomic; any other
+  L2 must have an atomic add(), as locmem, memcached and redis do,
+* refreshes values a little before they expire, with a probability that
+  grows as expiry nears and with how long the value took to compute, so
+  hot keys never expire for everyone at once (probabilistic early
+  expiration, "XFetch"),
+* never caches a None result.
+
+versioned_key() and invalidate_namespace() give every namespace a version
+number that is part of its keys, so a whole namespace can be dropped by
+bumping one counter.
+
+Hits, misses and latencies are counted per tier and per namespace, the
+part of the key before the first colon, and exposed by cache_stats().
+"""
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+# Number of locks used to serialise computing values in a process
+FLIGHT_LOCKS = 64
+
+_l1_stores = {}
+_l1_stores_lock = threading.Lock()
+
+
+class CacheStats:
+    """Hit and latency counters per namespace and tier"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = defaultdict(lambda: [0, 0, 0.0])
+
+    def record(self, namespace, tier, hit, seconds):
+        with self._lock:
+            counter = self._counters[(namespace, tier)]
+            counter[0 if hit else 1] += 1
+            counter[2] += seconds
+
+    def snapshot(self):
+        """Return hit ratios and mean latencies by namespace and tier."""
+        with self._lock:
+            counters = dict(self._counters)
+        result = defaultdict(dict)
+        for (namespace, tier), (hits, misses, seconds) in counters.items():
+            lookups = hits + misses
+            result[namespace][tier] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "avg_ms": seconds / lookups * 1000 if lookups else 0.0,
+            }
+        return dict(result)
+
+
+stats = CacheStats()
+
+
+def cache_stats():
+    """Return the cache statistics of this process."""
+    return stats.snapshot()
+
+
+def namespace_of(key):
+    return str(key).split(":", 1)[0]
+
+
+class TieredCache(BaseCache):
+    """In-process L1 cache in front of a shared L2 cache"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.l2_alias = options.get("L2", "shared")
+        self.l1_max_entries = options.get("L1_MAX_ENTRIES", 1000)
+        self.l1_timeout = options.get("L1_TIMEOUT", 5)
+        self.early_refresh_beta = options.get("EARLY_REFRESH_BETA", 1.0)
+        self.lock_timeout = options.get("LOCK_TIMEOUT", 10)
+
+        # Django makes a backend per thread, so like LocMemCache the L1
+        # lives at module level and is shared by name.
+        # Key -> (time L1 drops the entry, (value, expiry, delta))
+        with _l1_stores_lock:
+            self._l1, self._l1_lock, self._flights = _l1_stores.setdefault(
+                location,
+                (
+                    OrderedDict(),
+                    threading.Lock(),
+                    [threading.Lock() for _ in range(FLIGHT_LOCKS)],
+                ),
+            )
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _l1_get(self, key):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return entry[1]
+
+    def _l1_set(self, key, envelope):
+        expires = time.time() + self.l1_timeout
+        if envelope[1] is not None:
+            expires = min(expires, envelope[1])
+        with self._l1_lock:
+            self._l1[key] = (expires, envelope)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _get_envelope(self, key, namespace):
+        """Return (value, expiry, delta) from the nearest tier holding it."""
+        started = time.perf_counter()
+        envelope = self._l1_get(key)
+        stats.record(
+            namespace, "l1", envelope is not None,
+            time.perf_counter() - started,
+        )
+        if envelope is not None:
+            return envelope
+
+        started = time.perf_counter()
+        envelope = self.l2.get(key)
+        if envelope is not None and envelope[1] is not None and (
+            envelope[1] <= time.time()
+        ):
+            envelope = None
+        stats.record(
+            namespace, "l2", envelope is not None,
+            time.perf_counter() - started,
+        )
+        if envelope is not None:
+            self._l1_set(key, envelope)
+        return envelope
+
+    def _store(self, key, value, timeout, delta=0.0):
+        expiry = self.get_backend_timeout(timeout)
+        envelope = (value, expiry, delta)
+        l2_timeout = None if expiry is None else max(0, expiry - time.time())
+        self.l2.set(key, envelope, l2_timeout)
+        self._l1_set(key, envelope)
+
+    def _should_refresh(self, envelope):
+        """Decide whether to recompute a value before it expires."""
+        value, expiry, delta = envelope
+        if expiry is None:
+            return False
+        # -log(u) is exponentially distributed, mostly small but now and
+        # then large enough to refresh early
+        jitter = -math.log(1.0 - random.random())
+        return time.time() + delta * self.early_refresh_beta * jitter >= expiry
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        expiry = self.get_backend_timeout(timeout)
+        envelope = (value, expiry, 0.0)
+        l2_timeout = None if expiry is None else max(0, expiry - time.time())
+        if not self.l2.add(key, envelope, l2_timeout):
+            return False
+        self._l1_set(key, envelope)
+        return True
+
+    def get(self, key, default=None, version=None):
+        namespace = namespace_of(key)
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        envelope = self._get_envelope(key, namespace)
+        return default if envelope is None else envelope[0]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._store(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, version=version)
+        if value is None:
+            return False
+        self.set(key, value, timeout, version=version)
+        return True
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._l1_lock:
+            self._l1.pop(key, None)
+        return self.l2.delete(key)
+
+    def clear(self):
+        with self._l1_lock:
+            self._l1.clear()
+        self.l2.clear()
+
+    def incr(self, key, delta=1, version=None):
+        value = self.get(key, version=version)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        new_value = value + delta
+        self.set(key, new_value, None, version=version)
+        return new_value
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """Return the cached value, computing it at most once if missing."""
+        namespace = namespace_of(key)
+        full_key = self.make_key(key, version=version)
+        self.validate_key(full_key)
+
+        envelope = self._get_envelope(full_key, namespace)
+        if envelope is not None and not self._should_refresh(envelope):
+            return envelope[0]
+
+        flight = self._flights[hash(full_key) % FLIGHT_LOCKS]
+        with flight:
+            # Another thread may have filled the key while we waited
+            current = self._get_envelope(full_key, namespace)
+            if current is not None and current is not envelope:
+                return current[0]
+
+            lease = f"{full_key}:lease"
+            leased = self._take_lease(lease)
+            if not leased:
+                # Another process is computing it: serve what we have,
+                # or wait for theirs
+                if envelope is not None:
+                    return envelope[0]
+                current = self._wait_for(full_key, lease)
+                if current is not None:
+                    return current[0]
+            try:
+                started = time.perf_counter()
+                value = default() if callable(default) else default
+                delta = time.perf_counter() - started
+                if value is not None:
+                    self._store(full_key, value, timeout, delta)
+                return value
+            finally:
+                if leased:
+                    self._release_lease(lease)
+
+    def _lease_path(self, lease):
+        """Return the lock file of a lease when L2 is file based."""
+        if isinstance(self.l2, FileBasedCache):
+            # Not ending in .djcache, so culling and clear() leave it be
+            return self.l2._key_to_file(lease) + ".lease"
+        return None
+
+    def _take_lease(self, lease):
+        """Take a lease across processes, True if this one now holds it."""
+        path = self._lease_path(lease)
+        if path is None:
+            return self.l2.add(lease, 1, self.lock_timeout)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                if self._lease_held(lease):
+                    return False
+                # Left behind by a process that died holding it
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def _lease_held(self, lease):
+        path = self._lease_path(lease)
+        if path is None:
+            return self.l2.get(lease) is not None
+        try:
+            return time.time() - os.stat(path).st_mtime < self.lock_timeout
+        except FileNotFoundError:
+            return False
+
+    def _release_lease(self, lease):
+        path = self._lease_path(lease)
+        if path is None:
+            self.l2.delete(lease)
+            return
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _wait_for(self, key, lease):
+        """Poll L2 until another process stores a value or gives up."""
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.01)
+            envelope = self.l2.get(key)
+            if envelope is not None:
+                self._l1_set(key, envelope)
+                return envelope
+            if not self._lease_held(lease):
+                break
+        return None
+
+
+def versioned_key(namespace, key):
+    """Return a key that invalidate_namespace() can drop in bulk."""
+    version = cache.get(f"nsversion:{namespace}")
+    if version is None:
+        cache.add(f"nsversion:{namespace}", 1, None)
+        version = cache.get(f"nsversion:{namespace}", 1)
+    return f"{namespace}:{version}:{key}"
+
+
+def invalidate_namespace(namespace):
+    """Drop every key of a namespace by moving it to a new version."""
+    try:
+        cache.incr(f"nsversion:{namespace}")
+    except ValueError:
+        cache.set(f"nsversion:{namespace}", 2, None)
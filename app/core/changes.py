@@ -0,0 +1,180 @@
+"""
+Outbox of changes made to users.
+
+Every save or delete of a user that touches one of USER_FIELDS writes a
+UserChange in the same transaction (see User.save and core.signals), so
+the feed holds exactly the changes that were committed. Each entry
+carries the user's fields as of the change, so consumers can apply it
+without reading the user table. Bulk queryset updates bypass the feed.
+
+Consumers follow the feed with a cursor, the last change id seen on each
+user database, through read_changes() (or wait_for_changes() to long
+poll), the user changes API and the stream_user_changes command. Reads
+walk the primary key, so a page is one index range scan per database.
+Ids are handed out before commit, so a change can become visible after
+one with a higher id; a read stops at a gap in the ids until the gap is
+USER_CHANGES_SETTLE_SECONDS old, which keeps cursors from skipping it.
+
+compact() drops entries older than the retention period when a later
+entry exists for the same user. Following the feed from any cursor then
+still ends with every user's latest state. It walks the primary key in
+batches rather than searching by created, which has no index.
+"""
+import heapq
+import threading
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core import sharding
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# User fields published in the feed
+USER_FIELDS = ("email", "name", "is_active", "is_staff", "is_superuser")
+
+# How often a waiting reader checks for changes from other processes
+POLL_INTERVAL = 0.5
+
+_committed = threading.Condition()
+
+
+def _notify():
+    with _committed:
+        _committed.notify_all()
+
+
+def record(user, action, using, fields=USER_FIELDS, user_id=None):
+    """Record a change to a user in the current transaction."""
+    from core.models import UserChange
+
+    UserChange.objects.using(using).create(
+        user_id=user.pk if user_id is None else user_id,
+        action=action,
+        fields=list(fields),
+        data={name: getattr(user, name) for name in USER_FIELDS},
+    )
+    # Wake readers in this process once the change is visible
+    transaction.on_commit(_notify, using=using)
+
+
+def parse_cursor(cursor):
+    """Return the last change id seen on each database of a cursor."""
+    shards = sharding.get_shards()
+    positions = {}
+    for part in filter(None, (cursor or "").split(",")):
+        alias, _, last_id = part.rpartition(":")
+        if alias not in shards:
+            raise ValueError(f"Unknown database {alias!r} in cursor.")
+        positions[alias] = int(last_id)
+    return positions
+
+
+def format_cursor(positions):
+    """Return the cursor for the last change ids seen on each database."""
+    return ",".join(
+        f"{alias}:{positions.get(alias, 0)}" for alias in sharding.get_shards()
+    )
+
+
+def _visible(changes, after, settled):
+    """Return the changes up to the first gap that may still fill."""
+    expected = after + 1 if after else None
+    for position, change in enumerate(changes):
+        if (
+            expected is not None and change.id != expected
+            and change.created > settled
+        ):
+            return changes[:position]
+        expected = change.id + 1
+    return changes
+
+
+def read_changes(cursor, limit=100):
+    """Return up to limit changes after a cursor and the cursor after them.
+
+    Changes come as (change, cursor after the change) pairs.
+    """
+    from core.models import UserChange
+
+    positions = parse_cursor(cursor)
+    settled = timezone.now() - timedelta(
+        seconds=settings.USER_CHANGES_SETTLE_SECONDS
+    )
+    streams = []
+    for alias in sharding.get_shards():
+        after = positions.get(alias, 0)
+        changes = list(
+            UserChange.objects.using(alias)
+            .filter(id__gt=after)
+            .order_by("id")[:limit]
+        )
+        streams.append(
+            [(change, alias) for change in _visible(changes, after, settled)]
+        )
+
+    # Each database is read in id order, databases interleave by time
+    result = []
+    merged = heapq.merge(*streams, key=lambda item: item[0].created)
+    for change, alias in islice(merged, limit):
+        positions[alias] = change.id
+        result.append((change, format_cursor(positions)))
+    return result, format_cursor(positions)
+
+
+def wait_for_changes(cursor, limit=100, timeout=0.0):
+    """Return changes after a cursor, waiting up to timeout for some."""
+    deadline = time.monotonic() + timeout
+    while True:
+        changes, next_cursor = read_changes(cursor, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes, next_cursor
+        with _committed:
+            _committed.wait(min(POLL_INTERVAL, remaining))
+
+
+def compact(older_than=None, batch_size=1000):
+    """Drop old entries superseded by a later one for the same user."""
+    from core.models import UserChange
+
+    if older_than is None:
+        older_than = timedelta(days=settings.USER_CHANGES_RETENTION_DAYS)
+    cutoff = timezone.now() - older_than
+
+    deleted = 0
+    for alias in sharding.get_shards():
+        changes = UserChange.objects.using(alias)
+        newer = changes.filter(
+            user_id=OuterRef("user_id"), id__gt=OuterRef("id")
+        )
+        # Ids grow with created, so walk them from the oldest entry and
+        # stop at the first batch with nothing past the retention period.
+        # Every read is a range of the primary key, and small batches
+        # keep each delete's locks short.
+        after = 0
+        while True:
+            batch = list(
+                changes.filter(id__gt=after)
+                .order_by("id")
+                .values_list("id", "created")[:batch_size]
+            )
+            old = [change_id for change_id, created in batch
+                   if created < cutoff]
+            if not old:
+                break
+            stale = list(
+                changes.filter(Exists(newer), id__in=old)
+                .values_list("id", flat=True)
+            )
+            if stale:
+                deleted += changes.filter(id__in=stale).delete()[0]
+            after = batch[-1][0]
+    return deleted
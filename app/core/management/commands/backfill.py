@@ -0,0 +1,81 @@
+"""
+Django command to run batched, resumable backfills
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backfills import BACKFILLS
+from core.online import BackfillRunner
+
+
+class Command(BaseCommand):
+    """Django command to run a registered backfill online."""
+
+    help = (
+        "Run a backfill from core.backfills in throttled batches. Stopped "
+        "runs resume where they left off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", nargs="?", help="Backfill to run.")
+        parser.add_argument(
+            "--list", action="store_true", help="List known backfills.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Estimate rows and time without changing anything.",
+        )
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--max-batch-size", type=int, default=10000)
+        parser.add_argument(
+            "--max-lag", type=float, default=5.0,
+            help="Back off while replicas lag more than this many seconds.",
+        )
+        parser.add_argument(
+            "--max-lock-waits", type=int, default=10,
+            help="Back off while more lock requests than this are waiting.",
+        )
+        parser.add_argument(
+            "--pause", type=float, default=0.0,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--restart", action="store_true",
+            help="Start from the beginning instead of resuming.",
+        )
+
+    def handle(self, *args, **options):
+        if options["list"]:
+            for name in sorted(BACKFILLS):
+                self.stdout.write(name)
+            return
+
+        backfill = BACKFILLS.get(options["name"])
+        if backfill is None:
+            raise CommandError(f"Unknown backfill {options['name']!r}.")
+
+        runner = BackfillRunner(
+            backfill,
+            using=options["database"],
+            batch_size=options["batch_size"],
+            max_batch_size=options["max_batch_size"],
+            max_lag=options["max_lag"],
+            max_lock_waits=options["max_lock_waits"],
+            pause=options["pause"],
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+
+        if options["dry_run"]:
+            estimate = runner.estimate()
+            self.stdout.write(
+                f"{backfill.name}: about {estimate['rows']} rows in "
+                f"{estimate['windows']} batches, "
+                f"roughly {estimate['seconds']:.1f}s"
+            )
+            return
+
+        rows = runner.run(restart=options["restart"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{backfill.name}: updated {rows} rows."
+        ))
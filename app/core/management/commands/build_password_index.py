@@ -0,0 +1,38 @@
+"""
+Django command to build the breached password index
+"""
+
+from django.conf import settings
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.management.base import BaseCommand
+
+from core.passwords import build_index, read_passwords
+
+
+class Command(BaseCommand):
+    """Django command to build the breached password index."""
+
+    help = (
+        "Build the breached password index from a plain text list with "
+        "one password per line, by default Django's common passwords."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source", nargs="?",
+            default=CommonPasswordValidator.DEFAULT_PASSWORD_LIST_PATH,
+            help="Password list to index, may be gzipped.",
+        )
+        parser.add_argument(
+            "--output", default=settings.BREACHED_PASSWORDS_INDEX,
+            help="Where to write the index.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Indexing {options['source']}...")
+        count = build_index(
+            read_passwords(options["source"]), options["output"]
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} passwords into {options['output']}."
+        ))
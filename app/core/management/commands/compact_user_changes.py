@@ -0,0 +1,34 @@
+"""
+Django command to compact the user change feed
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.changes import compact
+
+
+class Command(BaseCommand):
+    """Django command to drop superseded user changes."""
+
+    help = (
+        "Drop user changes older than the retention period that a later "
+        "change to the same user supersedes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=float,
+            default=settings.USER_CHANGES_RETENTION_DAYS,
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = compact(
+            timedelta(days=options["older_than_days"]),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Dropped {deleted} superseded user changes."
+        ))
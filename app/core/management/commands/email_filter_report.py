@@ -0,0 +1,69 @@
+"""
+Django command to report the size and accuracy of the email filter
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.emailfilter import BloomFilter, email_filter, rebuild_capacity
+
+
+class Command(BaseCommand):
+    """Django command to report on the email filter."""
+
+    help = "Report email filter memory use and false positive rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000],
+            help="User counts to report memory use for.",
+        )
+        parser.add_argument(
+            "--measure", type=int, default=0,
+            help="Fill a filter with this many emails and measure its "
+                 "false positive rate.",
+        )
+
+    def handle(self, *args, **options):
+        error_rate = settings.EMAIL_FILTER_ERROR_RATE
+        self.stdout.write(f"Target false positive rate: {error_rate:.3%}")
+
+        # Sized as a rebuild would size the filter for that many users
+        for size in options["sizes"]:
+            bloom = BloomFilter(rebuild_capacity(size), error_rate)
+            self.stdout.write(
+                f"{size:>12,} users: {bloom.size_bytes / 2 ** 20:8.1f} MiB, "
+                f"{bloom.num_hashes} hashes, "
+                f"{bloom.num_bits / size:.1f} bits per email "
+                f"(capacity {bloom.capacity:,})"
+            )
+
+        if options["measure"]:
+            self.measure(options["measure"], error_rate)
+
+        if email_filter.enabled:
+            if email_filter.bloom is None:
+                email_filter.rebuild()
+            bloom = email_filter.bloom
+            self.stdout.write(
+                f"This process: {bloom.count:,} emails in "
+                f"{bloom.size_bytes / 2 ** 20:.1f} MiB "
+                f"(capacity {bloom.capacity:,})"
+            )
+
+    def measure(self, size, error_rate):
+        """Measure the false positive rate of a filter at capacity."""
+        bloom = BloomFilter(size, error_rate)
+        for i in range(size):
+            bloom.add(f"user{i}@example.com")
+
+        probes = max(size, 100_000)
+        false_positives = sum(
+            f"{uuid.uuid4().hex}@example.com" in bloom for _ in range(probes)
+        )
+        self.stdout.write(
+            f"Measured false positive rate at {size:,} emails: "
+            f"{false_positives / probes:.3%}"
+        )
@@ -0,0 +1,66 @@
+"""
+Django command to move users onto the shard their email hashes to
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import sharding
+from core.models import UserShard
+
+
+class Command(BaseCommand):
+    """Django command to rebalance users across shards."""
+
+    help = "Move users whose shard no longer matches their email hash."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of directory entries to scan per batch.",
+        )
+        parser.add_argument(
+            "--pause", type=float, default=0.0,
+            help="Seconds to sleep between batches to limit load.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Report the users that would move without moving them.",
+        )
+
+    def handle(self, *args, **options):
+        shards = sharding.get_shards()
+        directory = UserShard.objects.using(sharding.directory_db())
+        last_id = 0
+        scanned = moved = 0
+
+        # Walk the directory by id so the scan can run while users sign up
+        while True:
+            batch = list(
+                directory.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", "email", "shard")[:options["batch_size"]]
+            )
+            if not batch:
+                break
+
+            for user_id, email, shard in batch:
+                scanned += 1
+                target = sharding.pick_shard(email, shards)
+                if target == shard:
+                    continue
+                if options["dry_run"]:
+                    self.stdout.write(f"{user_id}: {shard} -> {target}")
+                    moved += 1
+                elif sharding.move_user(user_id, target):
+                    moved += 1
+
+            last_id = batch[-1][0]
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        verb = "Would move" if options["dry_run"] else "Moved"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} of {scanned} users."
+        ))
@@ -0,0 +1,166 @@
+"""
+Django command to replay captured traffic against a running server
+"""
+
+import json
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import NoReverseMatch, reverse
+
+from core.traffic import fill_shape, percentile, read_capture
+
+
+class Command(BaseCommand):
+    """Django command to replay a traffic capture."""
+
+    help = (
+        "Replay a capture written by TrafficCaptureMiddleware and report "
+        "latencies per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "capture", nargs="+",
+            help="Paths to capture files, one per worker process.",
+        )
+        parser.add_argument(
+            "--target", default="http://localhost:8000",
+            help="Base URL of the server to replay against.",
+        )
+        parser.add_argument(
+            "--speed", type=float, default=1.0,
+            help="Replay speed as a multiple of the captured rate, "
+                 "0 sends requests as fast as possible.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=4,
+            help="Number of requests in flight at once.",
+        )
+        parser.add_argument(
+            "--email", default="replay@example.com",
+            help="Account used for authenticated requests.",
+        )
+        parser.add_argument(
+            "--password", default="replay-pass-123",
+            help="Password of the replay account.",
+        )
+        parser.add_argument("--timeout", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        traces = sorted(
+            (
+                trace for path in options["capture"]
+                for trace in read_capture(path) if trace["url_name"]
+            ),
+            key=lambda trace: trace["ts"],
+        )
+        if not traces:
+            raise CommandError("Capture holds no replayable requests.")
+
+        self.target = options["target"].rstrip("/")
+        self.timeout = options["timeout"]
+        self.email = options["email"]
+        self.password = options["password"]
+        self.token = self.login()
+
+        results = self.replay(
+            traces, options["speed"], options["concurrency"]
+        )
+        self.report(results)
+
+    def login(self):
+        """Make sure the replay account exists and return its token."""
+        account = {"email": self.email, "password": self.password,
+                   "name": "Replay"}
+        # Creating fails harmlessly if the account is already there
+        self.send("POST", reverse("user:create"), account)
+        status, body = self.send("POST", reverse("user:token"), account)
+        if status != 200:
+            raise CommandError(f"Could not log in as {self.email}.")
+        return json.loads(body)["token"]
+
+    def replay(self, traces, speed, concurrency):
+        """Send traces on their captured schedule, scaled by speed."""
+        first = traces[0]["ts"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = []
+            for trace in traces:
+                if speed:
+                    delay = (trace["ts"] - first) / speed
+                    delay -= time.perf_counter() - start
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(pool.submit(self.replay_trace, trace))
+            return [future.result() for future in futures]
+
+    def replay_trace(self, trace):
+        """Rebuild and send one traced request, returning its timing."""
+        endpoint = f"{trace['method']} {trace['url_name']}"
+        try:
+            path = reverse(trace["url_name"], kwargs=trace["kwargs"])
+        except NoReverseMatch:
+            return endpoint, None, 0.0
+
+        fields = {"email": self.email, "password": self.password}
+        if trace["url_name"] == "user:create":
+            fields["email"] = f"replay-{uuid.uuid4().hex}@example.com"
+        body = None
+        if trace["body"] is not None:
+            body = fill_shape(trace["body"], fields)
+
+        started = time.perf_counter()
+        status, _ = self.send(
+            trace["method"], path, body, auth=trace["auth"]
+        )
+        return endpoint, status, (time.perf_counter() - started) * 1000
+
+    def send(self, method, path, body=None, auth=False):
+        """Send a JSON request to the target and return status and body."""
+        headers = {"Accept": "application/json"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        if auth:
+            headers["Authorization"] = f"Token {self.token}"
+
+        request = Request(
+            self.target + path, data=data, headers=headers, method=method
+        )
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except HTTPError as error:
+            return error.code, error.read()
+        except URLError:
+            return None, b""
+
+    def report(self, results):
+        """Write latency percentiles for every endpoint."""
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        for endpoint, status, latency in results:
+            if status is None or status >= 500:
+                errors[endpoint] += 1
+            else:
+                latencies[endpoint].append(latency)
+
+        for endpoint in sorted(set(latencies) | set(errors)):
+            values = sorted(latencies[endpoint])
+            self.stdout.write(
+                f"{endpoint}: n={len(values)} errors={errors[endpoint]} "
+                f"p50={percentile(values, 50):.1f}ms "
+                f"p90={percentile(values, 90):.1f}ms "
+                f"p99={percentile(values, 99):.1f}ms "
+                f"max={values[-1] if values else 0:.1f}ms"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {len(results)} requests."
+        ))
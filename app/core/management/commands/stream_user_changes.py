@@ -0,0 +1,49 @@
+"""
+Django command to stream the user change feed as JSON lines
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.changes import parse_cursor, wait_for_changes
+from core.serializers import UserChangeSerializer
+
+
+class Command(BaseCommand):
+    """Django command to print user changes after a cursor."""
+
+    help = (
+        "Print user changes as JSON lines, each with the cursor to resume "
+        "after it. With --follow, keep waiting for new changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cursor", default="",
+            help="Cursor to start after, from the start of the feed if unset.",
+        )
+        parser.add_argument(
+            "--follow", action="store_true",
+            help="Keep streaming changes as they are committed.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        cursor = options["cursor"]
+        try:
+            parse_cursor(cursor)
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        timeout = settings.USER_CHANGES_MAX_WAIT if options["follow"] else 0
+        while True:
+            changes, cursor = wait_for_changes(
+                cursor, options["batch_size"], timeout=timeout
+            )
+            for change, after in changes:
+                line = dict(UserChangeSerializer(change).data, cursor=after)
+                self.stdout.write(json.dumps(line))
+            self.stdout.flush()
+            if not changes and not options["follow"]:
+                return
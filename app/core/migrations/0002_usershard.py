@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserShard',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('email', models.EmailField(max_length=255, unique=True)),
+                ('shard', models.CharField(max_length=64)),
+            ],
+        ),
+    ]
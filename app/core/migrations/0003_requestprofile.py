@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_usershard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user_email', models.CharField(blank=True, max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('sample_count', models.PositiveIntegerField()),
+                ('query_count', models.PositiveIntegerField()),
+                ('query_time_ms', models.FloatField()),
+                ('stacks_file', models.CharField(max_length=500)),
+                ('summary', models.TextField()),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_requestprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('last_pk', models.BigIntegerField(default=0)),
+                ('rows_done', models.BigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
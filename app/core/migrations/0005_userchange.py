@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:10
+
+from django.db import migrations, models
+
+import core.online
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_backfillprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('fields', models.JSONField(default=list)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        core.online.AddNullableField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='userchange',
+            index=models.Index(fields=['user_id', 'id'], name='core_userch_user_id_0921bc_idx'),
+        ),
+    ]
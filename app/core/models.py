@@ -1,13 +1,16 @@
 """
 Database models.
 """
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
 
+from core import changes, sharding
+from core.emailfilter import email_filter
+
 
 class UserManager(BaseUserManager):
     """Manager for users"""
@@ -43,8 +46,155 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Only staff can logon to admin pages
     is_staff = models.BooleanField(default=False)
 
+    # Null for users last saved before the field was added
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+
     # Assign the user manager class to the User class
     objects = UserManager()
 
     # Set the field we want to use for authentication
     USERNAME_FIELD = "email"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user._remember_values()
+        return user
+
+    def _remember_values(self):
+        # Deferred fields are left out rather than loaded
+        self._loaded_values = {
+            name: self.__dict__[name]
+            for name in changes.USER_FIELDS if name in self.__dict__
+        }
+
+    def changed_fields(self, update_fields=None):
+        """Return the feed fields that differ from when the user loaded."""
+        loaded = getattr(self, "_loaded_values", {})
+        return [
+            name for name in changes.USER_FIELDS
+            if (update_fields is None or name in update_fields)
+            and name in self.__dict__
+            and (name not in loaded or self.__dict__[name] != loaded[name])
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save the user and record the change to the user feed."""
+        adding = self._state.adding
+        using = kwargs.get("using") or router.db_for_write(
+            self.__class__, instance=self
+        )
+        changed = self.changed_fields(kwargs.get("update_fields"))
+
+        # The change is recorded in the same transaction as the save
+        with transaction.atomic(using=using):
+            if not sharding.is_sharded():
+                super().save(*args, **kwargs)
+            elif not adding:
+                # A user moved off this shard must not be inserted again
+                # by a copy loaded before the move
+                kwargs.setdefault("force_update", True)
+                super().save(*args, **kwargs)
+                sharding.update_directory(self)
+            elif self.pk is not None:
+                super().save(*args, **kwargs)
+                sharding.update_directory(self)
+            else:
+                # Sharded ids come from the directory
+                self._save_new_sharded(*args, **kwargs)
+            if adding:
+                changes.record(self, changes.CREATED, using)
+            elif changed:
+                changes.record(self, changes.UPDATED, using, changed)
+        if adding or "email" in changed:
+            email_filter.add(self.email)
+        self._remember_values()
+
+    def _save_new_sharded(self, *args, **kwargs):
+        # Ids must be unique across shards, so take one from the directory
+        # before inserting and hand it back if the insert fails.
+        using = kwargs.get("using") or router.db_for_write(
+            self.__class__, instance=self
+        )
+        kwargs["using"] = using
+        self.pk = sharding.allocate_id(self.email, using)
+        kwargs["force_insert"] = True
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            sharding.release_id(self.pk)
+            self.pk = None
+            raise
+
+
+class UserShard(models.Model):
+    """Directory entry recording which shard holds a user."""
+
+    # The directory id doubles as the user's id on its shard
+    id = models.BigAutoField(primary_key=True)
+    email = models.EmailField(max_length=255, unique=True)
+    shard = models.CharField(max_length=64)
+
+
+class RequestProfile(models.Model):
+    """Profile of a single request captured on demand."""
+
+    created = models.DateTimeField(auto_now_add=True)
+    # Who the request ran as, blank for anonymous callers
+    user_email = models.CharField(max_length=255, blank=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    status = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    sample_count = models.PositiveIntegerField()
+    query_count = models.PositiveIntegerField()
+    query_time_ms = models.FloatField()
+    # Call stacks in folded format, ready for flamegraph tools
+    stacks_file = models.CharField(max_length=500)
+    summary = models.TextField()
+
+    class Meta:
+        ordering = ["-created"]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f}ms)"
+
+
+class BackfillProgress(models.Model):
+    """How far a batched backfill has got, so it can be resumed."""
+
+    name = models.CharField(max_length=255, unique=True)
+    # Rows with a primary key up to this one have been processed
+    last_pk = models.BigIntegerField(default=0)
+    rows_done = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UserChange(models.Model):
+    """Entry in the outbox of changes made to users."""
+
+    ACTION_CHOICES = [
+        ("created", "Created"),
+        ("updated", "Updated"),
+        ("deleted", "Deleted"),
+    ]
+
+    created = models.DateTimeField(auto_now_add=True)
+    # Not a foreign key so changes outlive deleted users
+    user_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # Fields the change touched
+    fields = models.JSONField(default=list)
+    # The user as of the change, enough to sync without reading the user
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["user_id", "id"])]
+
+    def __str__(self):
+        return f"{self.action} user {self.user_id}"
@@ -0,0 +1,274 @@
+"""
+Online schema changes for large tables.
+
+Plain migrations take locks that queue every login behind them on a big
+users table. The helpers here keep changes online:
+
+* AddNullableField adds a column without a default, which Postgres does
+  without rewriting the table, and gives up on its brief exclusive lock
+  quickly (then retries) rather than stalling queries queued behind it.
+* AddIndexConcurrently builds indexes with CREATE INDEX CONCURRENTLY on
+  Postgres and falls back to a normal index build elsewhere.
+* Backfill and BackfillRunner fill new columns in short batches walking
+  the primary key. Progress is saved with every batch so runs can be
+  stopped and resumed, and the runner backs off while replication lag or
+  lock waits are high. estimate() gives a dry run of rows and time.
+
+Backfills are registered in core.backfills and run with the backfill
+command.
+"""
+import time
+
+from django.apps import apps
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently as PostgresAddIndexConcurrently,
+)
+from django.db import OperationalError, connections, migrations, transaction
+from django.db.models import Max, Min, Q
+
+
+def _is_postgres(schema_editor):
+    return schema_editor.connection.vendor == "postgresql"
+
+
+class AddNullableField(migrations.AddField):
+    """Add a nullable column, failing fast instead of blocking queries."""
+
+    def __init__(self, model_name, name, field, lock_timeout="2s",
+                 retries=10, **kwargs):
+        if not field.null or field.has_default():
+            raise ValueError(
+                f"{model_name}.{name} must be nullable without a default "
+                "to be added online."
+            )
+        self.lock_timeout = lock_timeout
+        self.retries = retries
+        super().__init__(model_name, name, field, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        kwargs["lock_timeout"] = self.lock_timeout
+        kwargs["retries"] = self.retries
+        return name, args, kwargs
+
+    def describe(self):
+        return f"Add nullable field {self.name} to {self.model_name} online"
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+        # Each try runs in a savepoint so a lock timeout can be retried
+        # without failing the whole migration
+        alias = schema_editor.connection.alias
+        for attempt in range(self.retries + 1):
+            try:
+                with transaction.atomic(using=alias):
+                    schema_editor.execute(
+                        "SET LOCAL lock_timeout = %s", [self.lock_timeout]
+                    )
+                    super().database_forwards(
+                        app_label, schema_editor, from_state, to_state
+                    )
+                return
+            except OperationalError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(30, 0.5 * 2 ** attempt))
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """Build an index without blocking writes where the database can."""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if _is_postgres(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        return migrations.AddIndex.database_forwards(
+            self, app_label, schema_editor, from_state, to_state
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if _is_postgres(schema_editor):
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        return migrations.AddIndex.database_backwards(
+            self, app_label, schema_editor, from_state, to_state
+        )
+
+
+class Backfill:
+    """Set values on rows of a model in batches."""
+
+    def __init__(self, name, model, values, condition=None):
+        self.name = name
+        # "app_label.Model", resolved when the backfill runs
+        self.model_label = model
+        self.values = values
+        self.condition = condition or Q()
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def count(self, using, after_pk, until_pk):
+        """Count the rows of one primary key window still to change."""
+        return (
+            self.model._base_manager.using(using)
+            .filter(self.condition, pk__gt=after_pk, pk__lte=until_pk)
+            .count()
+        )
+
+    def update(self, using, after_pk, until_pk):
+        """Update one primary key window and return the rows changed."""
+        return (
+            self.model._base_manager.using(using)
+            .filter(self.condition, pk__gt=after_pk, pk__lte=until_pk)
+            .update(**self.values)
+        )
+
+
+class BackfillRunner:
+    """Run a backfill in throttled, resumable batches."""
+
+    def __init__(self, backfill, using="default", batch_size=1000,
+                 max_batch_size=10000, max_lag=5.0, max_lock_waits=10,
+                 pause=0.0, max_backoff=60.0, log=None):
+        self.backfill = backfill
+        self.using = using
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.max_lag = max_lag
+        self.max_lock_waits = max_lock_waits
+        self.pause = pause
+        self.max_backoff = max_backoff
+        self.log = log or (lambda message: None)
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def progress(self):
+        """Return the saved progress of the backfill."""
+        from core.models import BackfillProgress
+
+        progress, _ = BackfillProgress.objects.using(
+            self.using
+        ).get_or_create(name=self.backfill.name)
+        return progress
+
+    def pk_range(self):
+        """Return the primary keys before the first and of the last row."""
+        manager = self.backfill.model._base_manager.using(self.using)
+        bounds = manager.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["last"] is None:
+            return 0, 0
+        return bounds["first"] - 1, bounds["last"]
+
+    def replication_lag(self):
+        """Return the worst replica lag in seconds."""
+        if self.connection.vendor != "postgresql":
+            return 0.0
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) "
+                "FROM pg_stat_replication"
+            )
+            return float(cursor.fetchone()[0])
+
+    def lock_waits(self):
+        """Return the number of lock requests waiting to be granted."""
+        if self.connection.vendor != "postgresql":
+            return 0
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE NOT granted")
+            return cursor.fetchone()[0]
+
+    def under_pressure(self):
+        """Return True if the database should be left alone for now."""
+        return (
+            self.replication_lag() > self.max_lag
+            or self.lock_waits() > self.max_lock_waits
+        )
+
+    def estimate(self):
+        """Estimate rows to change and time to run without changing any.
+
+        Only reads: the rows left in the first window are counted and that
+        query is timed, so the time is a floor that ignores the writes.
+        """
+        from core.models import BackfillProgress
+
+        saved = BackfillProgress.objects.using(self.using).filter(
+            name=self.backfill.name
+        ).values_list("last_pk", flat=True).first() or 0
+        before_first, end = self.pk_range()
+        start = max(saved, before_first)
+        remaining = max(0, end - start)
+        if not remaining:
+            return {"rows": 0, "windows": 0, "seconds": 0.0}
+
+        window = min(self.batch_size, remaining)
+        started = time.perf_counter()
+        sample_rows = self.backfill.count(self.using, start, start + window)
+        elapsed = time.perf_counter() - started
+
+        windows = -(-remaining // self.batch_size)
+        return {
+            "rows": round(sample_rows / window * remaining),
+            "windows": windows,
+            "seconds": windows * (elapsed + self.pause),
+        }
+
+    def run(self, restart=False):
+        """Run the backfill to the end, returning the rows changed."""
+        progress = self.progress()
+        if restart:
+            progress.last_pk = 0
+            progress.rows_done = 0
+            progress.completed = False
+            progress.save()
+
+        # Skip straight to the first row rather than walk empty windows
+        before_first, end = self.pk_range()
+        progress.last_pk = max(progress.last_pk, before_first)
+        backoff = 0
+        rows = 0
+        while progress.last_pk < end:
+            if self.under_pressure():
+                # Smaller batches and growing pauses until it clears
+                delay = min(self.max_backoff, 2 ** backoff)
+                self.batch_size = max(1, self.batch_size // 2)
+                self.log(f"Backing off for {delay}s")
+                time.sleep(delay)
+                backoff += 1
+                continue
+            backoff = 0
+
+            until = min(end, progress.last_pk + self.batch_size)
+            with transaction.atomic(using=self.using):
+                changed = self.backfill.update(
+                    self.using, progress.last_pk, until
+                )
+                progress.last_pk = until
+                progress.rows_done += changed
+                progress.save()
+            rows += changed
+            self.log(f"{self.backfill.name}: up to pk {until} of {end}")
+
+            self.batch_size = min(
+                self.max_batch_size, int(self.batch_size * 1.25) + 1
+            )
+            if self.pause:
+                time.sleep(self.pause)
+
+        progress.completed = True
+        progress.save()
+        return rows
@@ -0,0 +1,203 @@
+"""
+Breached password checks backed by a memory-mapped index.
+
+The index is a sorted file of fixed size records, each the first
+RECORD_SIZE bytes of a password's SHA-1. It is memory-mapped read only, so
+every worker on a host shares the same page cache pages instead of
+loading its own copy of the list, and a lookup is a binary search of a
+few dozen page reads. Eight bytes of SHA-1 keep accidental matches
+negligible even with billions of entries.
+
+Build the index with the build_password_index command.
+"""
+import gzip
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext as _
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PWIDX1\0\0"
+RECORD_SIZE = 8
+
+# Hashes held in memory at once while building, 8 bytes each
+BUILD_CHUNK_SIZE = 5_000_000
+
+# Seconds between checks for a new or rebuilt index file
+INDEX_RECHECK_INTERVAL = 5
+
+
+def password_key(password):
+    """Return the index record for a password."""
+    if isinstance(password, str):
+        password = password.encode()
+    return hashlib.sha1(password).digest()[:RECORD_SIZE]
+
+
+class BreachedPasswordIndex:
+    """Read only view of a password index file"""
+
+    def __init__(self, path):
+        with open(path, "rb") as index:
+            self._map = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a password index.")
+        self.count = (len(self._map) - len(MAGIC)) // RECORD_SIZE
+
+    def _record(self, position):
+        offset = len(MAGIC) + position * RECORD_SIZE
+        return self._map[offset:offset + RECORD_SIZE]
+
+    def __contains__(self, password):
+        key = password_key(password)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self._record(low) == key
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+
+def read_passwords(path):
+    """Yield the passwords in a plain text list, which may be gzipped."""
+    try:
+        with gzip.open(path, "rb") as source:
+            for line in source:
+                yield line.strip()
+    except gzip.BadGzipFile:
+        with open(path, "rb") as source:
+            for line in source:
+                yield line.strip()
+
+
+def _write_run(keys, directory):
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".run")
+    with os.fdopen(handle, "wb") as run:
+        run.write(b"".join(sorted(keys)))
+    return path
+
+
+def _read_run(path):
+    with open(path, "rb") as run:
+        while True:
+            record = run.read(RECORD_SIZE)
+            if not record:
+                return
+            yield record
+
+
+def build_index(passwords, path, chunk_size=BUILD_CHUNK_SIZE):
+    """Write an index of passwords to path and return its entry count.
+
+    Lists larger than memory are sorted in chunks that are merged on
+    disk. The index is written next to path and moved into place, so
+    processes with the old index mapped keep reading it safely.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+
+    with tempfile.TemporaryDirectory(dir=path.parent) as workdir:
+        runs = []
+        chunk = set()
+        for password in passwords:
+            if not password:
+                continue
+            chunk.add(password_key(password))
+            if len(chunk) >= chunk_size:
+                runs.append(_write_run(chunk, workdir))
+                chunk = set()
+        if chunk:
+            runs.append(_write_run(chunk, workdir))
+
+        partial = Path(workdir) / "index"
+        with open(partial, "wb") as index:
+            index.write(MAGIC)
+            previous = None
+            for record in heapq.merge(*(_read_run(run) for run in runs)):
+                if record != previous:
+                    index.write(record)
+                    count += 1
+                    previous = record
+        os.replace(partial, path)
+
+    return count
+
+
+class BreachedPasswordValidator:
+    """
+    Validate that the password is not in a list of breached passwords.
+
+    The list is checked through a memory-mapped index, built when the image
+    is built or the container boots. Without an index the check is skipped
+    with a warning, rather than every process loading a password list into
+    memory. The file is checked every few seconds, so an index built or
+    rebuilt after the process started is picked up without a restart.
+    """
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path or settings.BREACHED_PASSWORDS_INDEX
+        self._index = None
+        self._index_stat = None
+        self._checked = None
+        self._warned = False
+
+    def _get_index(self):
+        now = time.monotonic()
+        if (
+            self._checked is not None
+            and now - self._checked < INDEX_RECHECK_INTERVAL
+        ):
+            return self._index
+        self._checked = now
+
+        try:
+            stat = os.stat(self.index_path)
+            # A rebuild replaces the file, so a new inode or mtime
+            stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat != self._index_stat:
+                # The old map is left to be closed once no lookup uses it
+                self._index = BreachedPasswordIndex(self.index_path)
+                self._index_stat = stat
+        except (OSError, ValueError) as exc:
+            if self._index is None and not self._warned:
+                logger.warning(
+                    "Breached password check skipped, no usable index at "
+                    "%s (%s). Build it with build_password_index.",
+                    self.index_path, exc,
+                )
+                self._warned = True
+        return self._index
+
+    def validate(self, password, user=None):
+        index = self._get_index()
+        if index is None:
+            return
+
+        # Lowercase too, as lists of common passwords usually are
+        candidates = {password, password.lower().strip()}
+        if any(candidate in index for candidate in candidates):
+            raise ValidationError(
+                _("This password has appeared in a data breach."),
+                code="password_breached",
+            )
+
+    def get_help_text(self):
+        return _("Your password can’t be one known from a data breach.")
@@ -0,0 +1,233 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries an X-Profile header signed with
+sign_profile_request(), or when a staff user sends X-Profile: 1 or adds
+?_profile=1 to an admin URL. While it runs, a background thread samples
+the request thread's call stack and every SQL query is timed. The stacks
+are written in the folded format read by flamegraph.pl and speedscope,
+and a RequestProfile row with a summary is saved for viewing in the
+admin.
+
+Requests without the header or query parameter only pay for a dict
+lookup, and each process runs at most REQUEST_PROFILE_MAX_CONCURRENT
+profiles at once.
+"""
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from rest_framework import exceptions
+
+from core.backends import ShardedTokenAuthentication
+from core.models import RequestProfile
+
+HEADER = "HTTP_X_PROFILE"
+QUERY_PARAM = "_profile"
+SALT = "core.profiling"
+
+# Number of slowest frames and queries kept in the summary
+SUMMARY_SIZE = 15
+
+
+def sign_profile_request():
+    """Return a header value that lets any caller profile one request."""
+    return signing.TimestampSigner(salt=SALT).sign(uuid.uuid4().hex)
+
+
+def _valid_signature(value):
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(
+            value, max_age=settings.REQUEST_PROFILE_SIGNATURE_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def frame_name(frame):
+    """Return a readable name for a stack frame."""
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Sample another thread's call stack at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the thread to finish."""
+        self._stop_event.set()
+        self.join()
+
+
+class QueryRecorder:
+    """Execute wrapper recording the SQL and duration of every query"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            self.queries.append((context["connection"].alias, sql, duration))
+
+
+def summarize(profile, stacks, queries):
+    """Return a plain text summary of the hottest frames and queries."""
+    self_samples = Counter()
+    for stack, count in stacks.items():
+        self_samples[stack.rsplit(";", 1)[-1]] += count
+    total = sum(stacks.values()) or 1
+
+    lines = [
+        f"{profile.method} {profile.path} -> {profile.status} "
+        f"in {profile.duration_ms:.1f}ms",
+        f"{profile.sample_count} samples, {profile.query_count} queries "
+        f"taking {profile.query_time_ms:.1f}ms",
+        "",
+        "Hottest frames (self time):",
+    ]
+    for name, count in self_samples.most_common(SUMMARY_SIZE):
+        lines.append(f"  {count / total:6.1%}  {name}")
+
+    lines += ["", "Slowest queries:"]
+    slowest = sorted(queries, key=lambda query: query[2], reverse=True)
+    for alias, sql, duration in slowest[:SUMMARY_SIZE]:
+        lines.append(f"  {duration:8.2f}ms  [{alias}] {sql}")
+    return "\n".join(lines)
+
+
+class RequestProfilingMiddleware:
+    """Profile requests that ask for it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(settings, "REQUEST_PROFILING", False):
+            raise MiddlewareNotUsed
+        self.slots = threading.BoundedSemaphore(
+            settings.REQUEST_PROFILE_MAX_CONCURRENT
+        )
+
+    def __call__(self, request):
+        # Cheap checks first so unprofiled requests pay almost nothing
+        requested = HEADER in request.META or (
+            QUERY_PARAM in request.META.get("QUERY_STRING", "")
+        )
+        if not requested:
+            return self.get_response(request)
+        if not self.allowed(request):
+            return self.get_response(request)
+
+        if not self.slots.acquire(blocking=False):
+            response = self.get_response(request)
+            response["X-Profile"] = "busy"
+            return response
+        try:
+            return self.profile(request)
+        finally:
+            self.slots.release()
+
+    def allowed(self, request):
+        """Return True if the caller may profile this request."""
+        header = request.META.get(HEADER, "")
+        if header and header != "1" and _valid_signature(header):
+            return True
+        user = self.caller(request)
+        return bool(user is not None and user.is_staff)
+
+    def caller(self, request):
+        """Return the user making the request, by session or by token."""
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return user
+        # API views authenticate tokens only once they run, so resolve
+        # the token here too
+        if not hasattr(request, "_profile_token_user"):
+            try:
+                result = ShardedTokenAuthentication().authenticate(request)
+            except exceptions.AuthenticationFailed:
+                result = None
+            request._profile_token_user = result[0] if result else None
+        return request._profile_token_user
+
+    def profile(self, request):
+        """Run the request under the sampler and query recorder."""
+        recorder = QueryRecorder()
+        sampler = StackSampler(
+            threading.get_ident(), settings.REQUEST_PROFILE_INTERVAL
+        )
+        wrappers = [
+            connections[alias].execute_wrapper(recorder)
+            for alias in connections
+        ]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            sampler.stop()
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+
+        profile = self.save(request, response, duration, sampler, recorder)
+        response["X-Profile"] = str(profile.pk)
+        return response
+
+    def save(self, request, response, duration, sampler, recorder):
+        """Write the folded stacks and store the profile."""
+        directory = Path(settings.REQUEST_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        path = directory / f"{name}.folded"
+        path.write_text("".join(
+            f"{stack} {count}\n" for stack, count in sampler.stacks.items()
+        ))
+
+        user = self.caller(request)
+        profile = RequestProfile(
+            user_email=getattr(user, "email", "") or "",
+            method=request.method,
+            path=request.path[:255],
+            status=response.status_code,
+            duration_ms=duration,
+            sample_count=sum(sampler.stacks.values()),
+            query_count=len(recorder.queries),
+            query_time_ms=sum(query[2] for query in recorder.queries),
+            stacks_file=str(path),
+        )
+        profile.summary = summarize(
+            profile, sampler.stacks, recorder.queries
+        )
+        profile.save()
+        return profile
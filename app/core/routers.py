@@ -0,0 +1,45 @@
+"""
+Database router for sharded users.
+"""
+from core import sharding
+
+
+class UserShardRouter:
+    """Route users and tokens to their shard and the directory to its db"""
+
+    def _is_sharded_model(self, model):
+        return model._meta.label in ("core.User", "authtoken.Token")
+
+    def db_for_write(self, model, **hints):
+        """Pick the shard a user or token row is written to."""
+        if model._meta.label == "core.UserShard":
+            return sharding.directory_db()
+        if not self._is_sharded_model(model):
+            return None
+
+        instance = hints.get("instance")
+        if instance is None:
+            return None
+        if instance._state.db:
+            return instance._state.db
+        # New rows: users go where their email hashes to and tokens
+        # follow the user they belong to
+        if model._meta.label == "authtoken.Token":
+            return instance.user._state.db
+        return sharding.pick_shard(instance.email)
+
+    def db_for_read(self, model, **hints):
+        """Read the directory from its database, everything else as usual."""
+        if model._meta.label == "core.UserShard":
+            return sharding.directory_db()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Only relate rows that live in the same database."""
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Keep the directory table on the directory database only."""
+        if app_label == "core" and model_name == "usershard":
+            return db == sharding.directory_db()
+        return None
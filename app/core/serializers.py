@@ -0,0 +1,64 @@
+"""
+Serializers for the core API views
+"""
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from rest_framework import serializers
+
+from core import changes
+from core.models import UserChange
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """Serializer for one request of a batch"""
+    method = serializers.ChoiceField(
+        choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+    )
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializer for a batch of user API requests"""
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+    atomic = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        """Limit the number of requests in a batch"""
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            msg = _('A batch can hold at most %(limit)d requests.') % {
+                'limit': settings.BATCH_MAX_REQUESTS,
+            }
+            raise serializers.ValidationError(msg)
+        return value
+
+
+class UserChangeSerializer(serializers.ModelSerializer):
+    """Serializer for user change feed entries"""
+
+    class Meta:
+        model = UserChange
+        fields = ['id', 'created', 'user_id', 'action', 'fields', 'data']
+        read_only_fields = fields
+
+
+class UserChangeQuerySerializer(serializers.Serializer):
+    """Serializer for the query of a user change feed read"""
+    cursor = serializers.CharField(allow_blank=True, default='')
+    limit = serializers.IntegerField(min_value=1, default=100)
+    wait = serializers.FloatField(min_value=0, default=0)
+
+    def validate_cursor(self, value):
+        """Check the cursor names known databases"""
+        try:
+            changes.parse_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError(_('Invalid cursor.'))
+        return value
+
+    def validate_limit(self, value):
+        return min(value, settings.USER_CHANGES_MAX_PAGE_SIZE)
+
+    def validate_wait(self, value):
+        return min(value, settings.USER_CHANGES_MAX_WAIT)
@@ -0,0 +1,274 @@
+"""
+Horizontal sharding of users across several databases.
+
+Users (and the tokens that hang off them) are placed on one of
+settings.USER_SHARDS by rendezvous hashing of their normalized email, so
+adding a shard only moves the users that now hash to it. A directory on
+settings.USER_SHARD_DIRECTORY hands out globally unique user ids and
+records where every user lives, which keeps lookups by id and by email
+to a single query even after users have been rebalanced.
+
+With a single shard configured everything here is a no-op and users stay
+on the default database exactly as before.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import BaseUserManager
+from django.core.cache import cache
+from django.db import transaction
+
+
+def get_shards():
+    """Return the database aliases users are spread across."""
+    return list(getattr(settings, "USER_SHARDS", ["default"]))
+
+
+def is_sharded():
+    """Return True when users are spread across more than one database."""
+    return len(get_shards()) > 1
+
+
+def directory_db():
+    """Return the database alias holding the shard directory."""
+    return getattr(settings, "USER_SHARD_DIRECTORY", "default")
+
+
+def normalize(email):
+    """Return the form of an email that placement is computed from."""
+    return BaseUserManager.normalize_email(email or "")
+
+
+def _score(shard, email):
+    """Stable weight of an email on a shard, same in every process."""
+    digest = hashlib.sha1(f"{shard}:{email}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def pick_shard(email, shards=None):
+    """Return the shard an email hashes to."""
+    shards = get_shards() if shards is None else shards
+    email = normalize(email)
+    return max(shards, key=lambda shard: _score(shard, email))
+
+
+def _directory():
+    from core.models import UserShard
+
+    return UserShard.objects.using(directory_db())
+
+
+def _email_key(email):
+    digest = hashlib.sha1(normalize(email).encode()).hexdigest()
+    return f"user:shard:email:{digest}"
+
+
+def _id_key(user_id):
+    return f"user:shard:id:{user_id}"
+
+
+def _forget(user_id=None, email=None):
+    """Drop cached shard lookups for a user."""
+    if user_id is not None:
+        cache.delete(_id_key(user_id))
+    if email is not None:
+        cache.delete(_email_key(email))
+
+
+def locate_email(email):
+    """Return the shard holding the user with this email."""
+    if not is_sharded():
+        return get_shards()[0]
+    shard = cache.get_or_set(
+        _email_key(email),
+        lambda: (
+            _directory()
+            .filter(email=normalize(email))
+            .values_list("shard", flat=True)
+            .first()
+        ),
+        settings.AUTH_CACHE_TIMEOUT,
+    )
+    # Unknown emails are looked for where a new user would be created
+    return shard or pick_shard(email)
+
+
+def locate_user(user_id):
+    """Return the shard holding the user with this id, or None."""
+    if not is_sharded():
+        return get_shards()[0]
+    return cache.get_or_set(
+        _id_key(user_id),
+        lambda: (
+            _directory()
+            .filter(pk=user_id)
+            .values_list("shard", flat=True)
+            .first()
+        ),
+        settings.AUTH_CACHE_TIMEOUT,
+    )
+
+
+def allocate_id(email, shard):
+    """Reserve a global user id for a new user on a shard."""
+    return _directory().create(email=normalize(email), shard=shard).pk
+
+
+def release_id(user_id):
+    """Drop the directory entry of a user that no longer exists."""
+    email = _directory().filter(pk=user_id).values_list(
+        "email", flat=True
+    ).first()
+    _directory().filter(pk=user_id).delete()
+    _forget(user_id, email)
+
+
+def lives_on(user_id, shard):
+    """Return False if the directory places the user on another shard.
+
+    A user being moved is deleted from its old shard only after the
+    directory points at the new one.
+    """
+    if not is_sharded():
+        return True
+    located = _directory().filter(pk=user_id).values_list(
+        "shard", flat=True
+    ).first()
+    return located in (None, shard)
+
+
+def update_directory(user):
+    """Keep the directory email in step with a saved user."""
+    email = _directory().filter(pk=user.pk).values_list(
+        "email", flat=True
+    ).first()
+    if email is not None and email != user.email:
+        _directory().filter(pk=user.pk).update(email=user.email)
+        _forget(email=email)
+
+
+def email_taken(email):
+    """Return True when a user on any shard already has this email."""
+    if not is_sharded():
+        users = get_user_manager(get_shards()[0])
+        return users.filter(email=normalize(email)).exists()
+    return _directory().filter(email=normalize(email)).exists()
+
+
+def all_emails():
+    """Return a queryset of every registered email."""
+    if not is_sharded():
+        users = get_user_manager(get_shards()[0])
+        return users.values_list("email", flat=True)
+    return _directory().values_list("email", flat=True)
+
+
+def get_user_manager(shard):
+    """Return the user manager bound to a shard."""
+    from core.models import User
+
+    return User.objects.db_manager(shard)
+
+
+def create_user(email, password=None, **extra_fields):
+    """Create, save and return a new user on the shard its email picks."""
+    shard = pick_shard(email)
+    return get_user_manager(shard).create_user(
+        email, password, **extra_fields
+    )
+
+
+def get_user(user_id):
+    """Return the user with this id from whichever shard holds it."""
+    from core.models import User
+
+    shard = locate_user(user_id)
+    if shard is not None:
+        try:
+            return get_user_manager(shard).get(pk=user_id)
+        except User.DoesNotExist:
+            if not is_sharded():
+                raise
+        # The cached shard may predate a move, so ask the directory again
+        _forget(user_id)
+        shard = locate_user(user_id)
+    if shard is None:
+        raise User.DoesNotExist(f"No shard holds user {user_id}.")
+    return get_user_manager(shard).get(pk=user_id)
+
+
+def get_user_by_email(email):
+    """Return the user with this email from whichever shard holds it."""
+    from core.models import User
+
+    try:
+        return get_user_manager(locate_email(email)).get_by_natural_key(
+            email
+        )
+    except User.DoesNotExist:
+        if not is_sharded():
+            raise
+    # The cached shard may predate a move, so ask the directory again
+    _forget(email=email)
+    return get_user_manager(locate_email(email)).get_by_natural_key(email)
+
+
+def move_user(user_id, target):
+    """Move a user, its permissions and token to another shard.
+
+    The user is copied to the target, the directory is pointed at the
+    copy and only then is the original removed, so reads by id or email
+    find the user at every step of the move. The original is locked for
+    the move, and a later save of a copy loaded from the old shard fails
+    instead of inserting the user there again.
+    """
+    from django.contrib.auth.models import Group, Permission
+    from rest_framework.authtoken.models import Token
+
+    from core.backends import forget_tokens
+    from core.models import User
+
+    with transaction.atomic(using=directory_db()):
+        entry = _directory().select_for_update().get(pk=user_id)
+        source = entry.shard
+        if source == target:
+            return False
+
+        with transaction.atomic(using=source), \
+                transaction.atomic(using=target):
+            # Saves to the original wait for the move, then find it gone
+            user = get_user_manager(source).select_for_update().get(
+                pk=user_id
+            )
+            # Groups and permissions are matched by natural key as their
+            # ids can differ between databases
+            group_names = list(user.groups.values_list("name", flat=True))
+            permission_keys = list(user.user_permissions.values_list(
+                "codename",
+                "content_type__app_label",
+                "content_type__model",
+            ))
+            token = Token.objects.using(source).filter(user=user).first()
+
+            # Bypass User.save so the existing directory entry is kept
+            user._state.adding = True
+            super(User, user).save(using=target, force_insert=True)
+            user.groups.set(
+                Group.objects.using(target).filter(name__in=group_names)
+            )
+            user.user_permissions.set([
+                Permission.objects.db_manager(target).get_by_natural_key(*key)
+                for key in permission_keys
+            ])
+            if token is not None:
+                Token.objects.using(target).create(key=token.key, user=user)
+
+            entry.shard = target
+            entry.save(update_fields=["shard"])
+
+            get_user_manager(source).filter(pk=user_id).delete()
+
+    _forget(user_id, entry.email)
+    # Cached token locations still point at the old shard
+    forget_tokens(user)
+    return True
@@ -0,0 +1,49 @@
+"""
+Signal receivers keeping derived state in step with users and tokens.
+
+Receivers rather than model method overrides, because queryset deletes
+such as the admin's "Delete selected" never call Model.delete(). Django
+still sends post_delete for every row it deletes, inside the delete's
+transaction.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from core import changes, sharding
+from core.backends import token_cache_key
+from core.emailfilter import email_filter
+from core.models import User
+
+
+@receiver(post_delete, sender=User)
+def release_user_id(sender, instance, using, **kwargs):
+    """Free the directory entry, and so the email, of a deleted user."""
+    # The copy left behind by a move is deleted after the directory
+    # points at the new shard, so its entry stays
+    if sharding.is_sharded() and sharding.lives_on(instance.pk, using):
+        sharding.release_id(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def record_user_deleted(sender, instance, using, **kwargs):
+    """Record a deleted user in the user feed, in the delete's transaction."""
+    # A move deletes the old copy, but the user lives on
+    if sharding.lives_on(instance.pk, using):
+        changes.record(instance, changes.DELETED, using)
+
+
+@receiver(post_delete, sender=User)
+def discard_user_email(sender, instance, using, **kwargs):
+    """Count a deleted user's email towards rebuilding the email filter."""
+    if sharding.lives_on(instance.pk, using):
+        email_filter.discard(instance.email)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """Drop the cached location of a deleted token."""
+    # Also sent for the tokens removed along with their user
+    cache.delete(token_cache_key(instance.key))
@@ -0,0 +1,259 @@
+"""
+Collection and serving of static files in production.
+
+collectstatic with CompressedManifestStaticFilesStorage stores every file
+under a content hashed name, and stores gzip and, when the Brotli package
+is installed, brotli compressed copies next to the files worth
+compressing.
+
+StaticFilesMiddleware serves STATIC_ROOT without reaching the URLconf.
+At startup it indexes the collected files once, with their types, sizes,
+ETags and compressed variants, so a request is a dictionary lookup. It
+picks the variant the client accepts from Accept-Encoding, answers
+conditional requests with 304, marks hashed names as cacheable forever
+and returns files as FileResponse, which WSGI servers send with
+sendfile() through wsgi.file_wrapper.
+
+In development (DEBUG) runserver keeps serving files from the apps.
+"""
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage,
+    staticfiles_storage,
+)
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, files are then only gzipped
+    brotli = None
+
+# Compressed variants by encoding, most preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+COMPRESSIBLE_EXTENSIONS = {
+    ".css", ".eot", ".html", ".ico", ".js", ".json", ".map", ".otf",
+    ".svg", ".ttf", ".txt", ".xml",
+}
+
+# Smaller files gain nothing from compression
+MIN_COMPRESS_SIZE = 256
+
+# Hashed names never change content, other names are checked again soon
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CACHE_CONTROL = "public, max-age=60"
+
+
+def compress(data):
+    """Return the compressed variants of data that are worth keeping."""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {
+        encoding: compressed for encoding, compressed in variants.items()
+        if len(compressed) < len(data) * 0.95
+    }
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Content hashed static files with precompressed copies"""
+
+    def stored_name(self, name):
+        # Until collectstatic has run, as in tests, use the plain names
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # The manifest holds the final hashed names, earlier passes may
+        # have yielded others
+        for name in sorted(set(paths) | set(self.hashed_files.values())):
+            self.compress(name)
+
+    def compress(self, name):
+        """Store the compressed copies of a collected file."""
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+
+        variants = compress(data)
+        for encoding, suffix in ENCODINGS:
+            if encoding not in variants:
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(variants[encoding]))
+
+
+class StaticAsset:
+    """A collected file and its compressed variants"""
+
+    def __init__(self, path, cache_control):
+        stat = os.stat(path)
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in (
+            "application/javascript", "application/json",
+        ):
+            content_type += "; charset=utf-8"
+
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.last_modified = http_date(stat.st_mtime)
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        # Encoding -> (path, size, ETag)
+        self.variants = {"identity": (path, stat.st_size, self.etag)}
+
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix):
+                self.variants[encoding] = (
+                    path + suffix,
+                    os.path.getsize(path + suffix),
+                    f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{encoding}"',
+                )
+
+
+def build_index(root, url, immutable_names=()):
+    """Map the URL of every collected file to its StaticAsset."""
+    compressed_suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    immutable_names = set(immutable_names)
+    index = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if path.endswith(compressed_suffixes) and os.path.isfile(
+                path[:-3]
+            ):
+                # Served as a variant of the original
+                continue
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            cache_control = (
+                IMMUTABLE_CACHE_CONTROL if name in immutable_names
+                else CACHE_CONTROL
+            )
+            index[url + name] = StaticAsset(path, cache_control)
+    return index
+
+
+def accepted_encodings(header):
+    """Return the quality of each coding listed in Accept-Encoding."""
+    qualities = {}
+    for coding in header.split(","):
+        coding, *params = coding.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def negotiate(header, available):
+    """Return the available encoding to serve for an Accept-Encoding."""
+    qualities = accepted_encodings(header or "")
+    wildcard = qualities.get("*")
+    # Identity is the fallback, it only competes when listed
+    identity = qualities.get("identity", wildcard or 0.0)
+
+    best, best_quality = "identity", 0.0
+    for encoding, _ in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = qualities.get(encoding, wildcard or 0.0)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    if best_quality and best_quality >= identity:
+        return best
+    return "identity"
+
+
+def serve(request, asset):
+    """Return the response for a request of a collected file."""
+    encoding = negotiate(
+        request.META.get("HTTP_ACCEPT_ENCODING"), asset.variants
+    )
+    path, size, etag = asset.variants[encoding]
+
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        not_modified = "*" in etags or etag in etags
+    else:
+        not_modified = not was_modified_since(
+            request.META.get("HTTP_IF_MODIFIED_SINCE"),
+            asset.mtime,
+            asset.size,
+        )
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    elif request.method == "HEAD":
+        response = HttpResponse()
+        response["Content-Length"] = size
+    else:
+        response = FileResponse(open(path, "rb"))
+        del response["Content-Disposition"]
+
+    if not not_modified:
+        response["Content-Type"] = asset.content_type
+        response["Last-Modified"] = asset.last_modified
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Cache-Control"] = asset.cache_control
+    response["X-Content-Type-Options"] = "nosniff"
+    if len(asset.variants) > 1:
+        response["Vary"] = "Accept-Encoding"
+    return response
+
+
+class StaticFilesMiddleware:
+    """Serve collected static files from an in-memory index"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        root = settings.STATIC_ROOT
+        url = settings.STATIC_URL
+        if settings.DEBUG or not root or not os.path.isdir(root) or (
+            not url.startswith("/")
+        ):
+            raise MiddlewareNotUsed
+
+        self.url = url
+        self.index = build_index(
+            root,
+            url,
+            getattr(staticfiles_storage, "hashed_files", {}).values(),
+        )
+
+    def __call__(self, request):
+        if request.method in ("GET", "HEAD") and request.path.startswith(
+            self.url
+        ):
+            asset = self.index.get(request.path)
+            if asset is not None:
+                return serve(request, asset)
+        return self.get_response(request)
@@ -0,0 +1,222 @@
+"""
+Tests for the batch request endpoint
+"""
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import sharding
+from core.backends import ShardedTokenAuthentication
+from core.models import UserChange, UserShard
+
+BATCH_URL = reverse('batch')
+CREATE_USER_URL = reverse('user:create')
+TOKEN_URL = reverse('user:token')
+ME_URL = reverse('user:me')
+
+
+def statuses(res):
+    return [result['status'] for result in res.data['results']]
+
+
+class PublicBatchApiTests(TestCase):
+    """Test batches sent without authentication"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_signup_login_and_read_in_one_batch(self):
+        """Test a token from the batch authenticates later requests"""
+        payload = {'requests': [
+            {'method': 'POST', 'path': CREATE_USER_URL, 'body': {
+                'email': 'test@example.com',
+                'password': 'testpass123',
+                'name': 'Test Name',
+            }},
+            {'method': 'POST', 'path': TOKEN_URL, 'body': {
+                'email': 'test@example.com',
+                'password': 'testpass123',
+            }},
+            {'method': 'GET', 'path': ME_URL},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(statuses(res), [201, 200, 200])
+        self.assertIn('token', res.data['results'][1]['body'])
+        self.assertEqual(
+            res.data['results'][2]['body']['email'], 'test@example.com'
+        )
+
+    def test_rolled_back_batch_returns_no_token(self):
+        """Test a token from a rolled back batch is not handed out"""
+        payload = {'atomic': True, 'requests': [
+            {'method': 'POST', 'path': CREATE_USER_URL, 'body': {
+                'email': 'test@example.com',
+                'password': 'testpass123',
+                'name': 'Test Name',
+            }},
+            {'method': 'POST', 'path': TOKEN_URL, 'body': {
+                'email': 'test@example.com',
+                'password': 'testpass123',
+            }},
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'password': 'pw'}},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [201, 200, 400])
+        self.assertTrue(res.data['rolled_back'])
+        self.assertNotIn('token', res.data['results'][1]['body'])
+        self.assertFalse(Token.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_anonymous_requests_unauthorized(self):
+        """Test requests needing a user fail without one"""
+        payload = {'requests': [{'method': 'GET', 'path': ME_URL}]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [401])
+
+    def test_only_user_api_can_be_batched(self):
+        """Test paths outside the user API are not found"""
+        payload = {'requests': [
+            {'method': 'POST', 'path': BATCH_URL},
+            {'method': 'GET', 'path': reverse('cache-stats')},
+            {'method': 'GET', 'path': '/api/user/missing/'},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [404, 404, 404])
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_batch_size_limited(self):
+        """Test batches over the size limit are rejected"""
+        payload = {'requests': [{'method': 'GET', 'path': ME_URL}] * 3}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PrivateBatchApiTests(TestCase):
+    """Test batches sent by an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='testpass123',
+            name='Test Name',
+        )
+        self.token = Token.objects.using(
+            self.user._state.db
+        ).create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_authenticates_once(self):
+        """Test the caller is authenticated once for the whole batch"""
+        payload = {'requests': [
+            {'method': 'GET', 'path': ME_URL},
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'name': 'New'}},
+            {'method': 'GET', 'path': ME_URL},
+        ]}
+
+        with patch.object(
+            ShardedTokenAuthentication, 'authenticate_credentials',
+            autospec=True,
+            side_effect=ShardedTokenAuthentication.authenticate_credentials,
+        ) as authenticate:
+            res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [200, 200, 200])
+        self.assertEqual(authenticate.call_count, 1)
+        self.assertEqual(res.data['results'][2]['body']['name'], 'New')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New')
+
+    def test_failures_do_not_stop_batch(self):
+        """Test requests after a failure run when not atomic"""
+        payload = {'requests': [
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'password': 'pw'}},
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'name': 'New'}},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [400, 200])
+        self.assertFalse(res.data['rolled_back'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New')
+
+    def test_atomic_batch_rolled_back(self):
+        """Test a failure in an atomic batch undoes it and skips the rest"""
+        payload = {'atomic': True, 'requests': [
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'name': 'New'}},
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'password': 'pw'}},
+            {'method': 'GET', 'path': ME_URL},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [200, 400, 424])
+        self.assertTrue(res.data['rolled_back'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'Test Name')
+
+    @override_settings(BATCH_MAX_CPU_TIME=0.000001)
+    def test_cpu_time_limited(self):
+        """Test requests are not run once the CPU budget is used"""
+        payload = {'requests': [
+            {'method': 'PATCH', 'path': ME_URL, 'body': {'name': 'New'}},
+            {'method': 'GET', 'path': ME_URL},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [200, 503])
+
+
+@skipUnless(len(settings.USER_SHARDS) > 1, 'Needs at least two shards')
+class ShardedBatchApiTests(TestCase):
+    """Test atomic batches across user shards"""
+
+    databases = '__all__'
+
+    def test_atomic_batch_rolled_back_on_every_shard(self):
+        """Test a signup to another shard is undone with the batch"""
+        email = next(
+            f'user{i}@example.com' for i in range(100)
+            if sharding.pick_shard(f'user{i}@example.com')
+            != sharding.directory_db()
+        )
+        shard = sharding.pick_shard(email)
+        payload = {'atomic': True, 'requests': [
+            {'method': 'POST', 'path': CREATE_USER_URL, 'body': {
+                'email': email,
+                'password': 'testpass123',
+                'name': 'Test Name',
+            }},
+            {'method': 'GET', 'path': '/api/nowhere/'},
+        ]}
+
+        res = APIClient().post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(statuses(res), [201, 404])
+        self.assertTrue(res.data['rolled_back'])
+        self.assertFalse(UserShard.objects.exists())
+        self.assertFalse(
+            get_user_model().objects.using(shard).exists()
+        )
+        self.assertFalse(UserChange.objects.using(shard).exists())
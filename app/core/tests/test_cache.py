@@ -0,0 +1,241 @@
+"""
+Tests for the tiered cache
+"""
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import exceptions, status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.backends import ShardedTokenAuthentication
+from core.cache import (
+    cache_stats,
+    invalidate_namespace,
+    stats,
+    versioned_key,
+)
+
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "core.cache.TieredCache",
+        "LOCATION": "core-tests",
+        "OPTIONS": {"L2": "shared", "L1_MAX_ENTRIES": 3, "L1_TIMEOUT": 60},
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "core-tests",
+    },
+}
+
+CACHE_STATS_URL = reverse("cache-stats")
+ME_URL = reverse("user:me")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TieredCacheTests(TestCase):
+    """Test the two tier cache backend"""
+
+    def setUp(self):
+        cache.clear()
+        stats.reset()
+
+    def test_set_and_get_through_tiers(self):
+        """Test values are served from L1 and refilled from L2"""
+        cache.set("user:a", 1)
+
+        self.assertEqual(cache.get("user:a"), 1)
+        caches["default"]._l1.clear()
+        self.assertEqual(cache.get("user:a"), 1)
+        self.assertEqual(cache.get("user:a"), 1)
+
+        user_stats = cache_stats()["user"]
+        self.assertEqual(user_stats["l1"]["hits"], 2)
+        self.assertEqual(user_stats["l1"]["misses"], 1)
+        self.assertEqual(user_stats["l2"]["hits"], 1)
+
+    def test_l1_is_bounded(self):
+        """Test L1 drops the least recently used keys past its size"""
+        for key in "abcd":
+            cache.set(f"user:{key}", key)
+
+        self.assertEqual(len(caches["default"]._l1), 3)
+        self.assertEqual(cache.get("user:a"), "a")
+
+    def test_delete_clears_both_tiers(self):
+        """Test deleting a key removes it everywhere"""
+        cache.set("user:a", 1)
+        cache.delete("user:a")
+
+        self.assertIsNone(cache.get("user:a"))
+        self.assertIsNone(caches["shared"].get(
+            caches["default"].make_key("user:a")
+        ))
+
+    def test_get_or_set_computes_once(self):
+        """Test concurrent misses compute the value a single time"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    cache.get_or_set("user:slow", compute, 60)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 8)
+
+    def test_get_or_set_waits_for_other_process(self):
+        """Test a miss waits while another process holds the lease"""
+        backend = caches["default"]
+        key = backend.make_key("user:shared")
+        caches["shared"].add(f"{key}:lease", 1, 10)
+
+        def other_process():
+            time.sleep(0.05)
+            caches["shared"].set(key, ("theirs", None, 0.0))
+
+        threading.Thread(target=other_process).start()
+        value = cache.get_or_set("user:shared", lambda: "ours", 60)
+
+        self.assertEqual(value, "theirs")
+
+    def test_file_lease_taken_once(self):
+        """Test a file based L2 hands a lease to one process at a time"""
+        with tempfile.TemporaryDirectory() as tmp:
+            file_caches = dict(TEST_CACHES, shared={
+                "BACKEND": "django.core.cache.backends.filebased."
+                           "FileBasedCache",
+                "LOCATION": tmp,
+            })
+            with override_settings(CACHES=file_caches):
+                backend = caches["default"]
+                self.assertTrue(backend._take_lease("user:a:lease"))
+                self.assertFalse(backend._take_lease("user:a:lease"))
+                self.assertTrue(backend._lease_held("user:a:lease"))
+
+                backend._release_lease("user:a:lease")
+                self.assertTrue(backend._take_lease("user:a:lease"))
+
+                # A lease outlives its holder only for lock_timeout
+                path = backend._lease_path("user:a:lease")
+                stale = time.time() - backend.lock_timeout - 1
+                os.utime(path, (stale, stale))
+                self.assertTrue(backend._take_lease("user:a:lease"))
+                backend._release_lease("user:a:lease")
+
+    def test_get_or_set_does_not_cache_none(self):
+        """Test None results are recomputed next time"""
+        self.assertIsNone(cache.get_or_set("user:none", lambda: None))
+        self.assertEqual(cache.get_or_set("user:none", lambda: 1), 1)
+
+    @patch("core.cache.random.random", return_value=0.5)
+    def test_early_refresh(self, patched_random):
+        """Test slow values near expiry are refreshed early"""
+        backend = caches["default"]
+        soon = time.time() + 1
+
+        self.assertTrue(backend._should_refresh(("v", soon, 10.0)))
+        self.assertFalse(backend._should_refresh(("v", soon, 0.0)))
+        self.assertFalse(backend._should_refresh(("v", None, 10.0)))
+
+    def test_invalidate_namespace(self):
+        """Test bumping a namespace version hides all of its keys"""
+        key = versioned_key("auth", "token:abc")
+        cache.set(key, 1)
+
+        invalidate_namespace("auth")
+
+        new_key = versioned_key("auth", "token:abc")
+        self.assertNotEqual(key, new_key)
+        self.assertIsNone(cache.get(new_key))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AuthCacheTests(TestCase):
+    """Test token lookups are cached and invalidated"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email="test@example.com", password="testpass123", name="Test",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.auth = ShardedTokenAuthentication()
+
+    def test_token_lookup_cached(self):
+        """Test a repeated token lookup only reads the token and user"""
+        self.auth.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(1):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+
+    def test_token_lookup_sees_user_changes(self):
+        """Test a cached token lookup returns the user as it is now"""
+        self.auth.authenticate_credentials(self.token.key)
+
+        self.user.name = "Changed"
+        self.user.set_password("newpass123")
+        self.user.save()
+
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.name, "Changed")
+        self.assertTrue(user.check_password("newpass123"))
+
+    def test_deleted_token_rejected(self):
+        """Test a deleted token no longer authenticates"""
+        self.auth.authenticate_credentials(self.token.key)
+
+        Token.objects.filter(key=self.token.key).delete()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_bulk_deleted_user_not_recreated(self):
+        """Test a user deleted in bulk cannot be written back by token"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        client.get(ME_URL)
+
+        get_user_model().objects.filter(pk=self.user.pk).delete()
+        res = client.patch(ME_URL, {"name": "Back"})
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_cache_stats_for_staff_only(self):
+        """Test only staff can read the cache statistics"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.get(CACHE_STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.auth.authenticate_credentials(self.token.key)
+        res = client.get(CACHE_STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("l1", res.data["auth"])
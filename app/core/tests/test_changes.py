@@ -0,0 +1,278 @@
+"""
+Tests for the user change feed
+"""
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import changes
+from core.backfills import BACKFILLS
+from core.models import UserChange
+
+USER_CHANGES_URL = reverse('user-changes')
+ME_URL = reverse('user:me')
+
+
+def create_user(email='user@example.com', **params):
+    return get_user_model().objects.create_user(email, **params)
+
+
+class UserChangeRecordTests(TestCase):
+    """Test changes are recorded with the writes that make them"""
+
+    def test_create_recorded(self):
+        """Test creating a user records the whole user"""
+        user = create_user(name='Test')
+
+        change = UserChange.objects.get()
+        self.assertEqual(change.user_id, user.id)
+        self.assertEqual(change.action, changes.CREATED)
+        self.assertEqual(change.data['email'], 'user@example.com')
+        self.assertEqual(change.data['name'], 'Test')
+        self.assertIsNotNone(user.updated_at)
+
+    def test_update_records_changed_fields(self):
+        """Test an update through the API records the fields it changed"""
+        user = create_user(password='testpass123', name='Test')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        client.patch(ME_URL, {'name': 'New'})
+
+        change = UserChange.objects.last()
+        self.assertEqual(change.action, changes.UPDATED)
+        self.assertEqual(change.fields, ['name'])
+        self.assertEqual(change.data['name'], 'New')
+
+    def test_admin_save_recorded(self):
+        """Test saving a user in the admin records the change"""
+        admin = get_user_model().objects.create_superuser(
+            'admin@example.com', 'Pa55w0rd!'
+        )
+        user = create_user()
+        self.client.force_login(admin)
+
+        self.client.post(
+            reverse('admin:core_user_change', args=[user.id]),
+            {'email': 'user@example.com', 'is_active': 'on', 'is_staff': 'on'},
+        )
+
+        change = UserChange.objects.last()
+        self.assertEqual(change.user_id, user.id)
+        self.assertEqual(change.fields, ['is_staff'])
+
+    def test_unpublished_changes_not_recorded(self):
+        """Test saves that only touch other fields record nothing"""
+        user = create_user()
+
+        update_last_login(None, user)
+        user.set_password('newpass123')
+        user.save()
+
+        self.assertEqual(UserChange.objects.count(), 1)
+
+    def test_rolled_back_change_not_recorded(self):
+        """Test a change rolled back with its transaction leaves no entry"""
+        user = create_user()
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            user.name = 'New'
+            user.save()
+            raise RuntimeError
+
+        self.assertEqual(UserChange.objects.count(), 1)
+
+    def test_delete_recorded(self):
+        """Test deleting a user records a tombstone"""
+        user = create_user()
+        user_id = user.id
+
+        user.delete()
+
+        change = UserChange.objects.last()
+        self.assertEqual(change.action, changes.DELETED)
+        self.assertEqual(change.user_id, user_id)
+
+    def test_admin_bulk_delete_recorded(self):
+        """Test deleting users with the admin action records each one"""
+        admin = get_user_model().objects.create_superuser(
+            'admin@example.com', 'Pa55w0rd!'
+        )
+        user = create_user()
+        self.client.force_login(admin)
+
+        self.client.post(reverse('admin:core_user_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [user.id],
+            'post': 'yes',
+        })
+
+        self.assertFalse(get_user_model().objects.filter(id=user.id).exists())
+        change = UserChange.objects.last()
+        self.assertEqual(change.action, changes.DELETED)
+        self.assertEqual(change.user_id, user.id)
+
+    def test_updated_at_backfill_registered(self):
+        """Test users from before updated_at can be backfilled"""
+        self.assertIn('user-updated-at', BACKFILLS)
+
+
+class UserChangeFeedTests(TestCase):
+    """Test reading the feed from a cursor"""
+
+    def setUp(self):
+        self.users = [create_user(f'user{i}@example.com') for i in range(5)]
+
+    def test_read_resumes_from_cursor(self):
+        """Test pages follow on from the cursor in order"""
+        first, cursor = changes.read_changes('', limit=3)
+        rest, cursor = changes.read_changes(cursor, limit=10)
+        empty, final = changes.read_changes(cursor)
+
+        emails = [change.data['email'] for change, _ in first + rest]
+        self.assertEqual(
+            emails, [f'user{i}@example.com' for i in range(5)]
+        )
+        self.assertEqual(first[-1][1], f'default:{first[-1][0].id}')
+        self.assertEqual(empty, [])
+        self.assertEqual(final, cursor)
+
+    def test_read_waits_for_recent_gap(self):
+        """Test a read stops at a new gap until it settles"""
+        entries = list(UserChange.objects.all())
+        entries[2].delete()
+        cursor = changes.format_cursor({'default': entries[0].id})
+
+        visible, _ = changes.read_changes(cursor)
+        self.assertEqual([change for change, _ in visible], entries[1:2])
+
+        with override_settings(USER_CHANGES_SETTLE_SECONDS=-1):
+            visible, _ = changes.read_changes(cursor)
+        self.assertEqual(len(visible), 3)
+
+    def test_invalid_cursor(self):
+        """Test cursors for unknown databases are rejected"""
+        with self.assertRaises(ValueError):
+            changes.parse_cursor('elsewhere:1')
+
+    def test_compact_keeps_latest_per_user(self):
+        """Test only old entries with a later one for the user are dropped"""
+        first, second = self.users[:2]
+        first.name = 'New'
+        first.save()
+        UserChange.objects.update(created=timezone.now() - timedelta(days=30))
+        second.name = 'New'
+        second.save()
+        second.name = 'Newer'
+        second.save()
+
+        deleted = changes.compact(timedelta(days=7))
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(
+            [c.action for c in UserChange.objects.filter(user_id=first.id)],
+            [changes.UPDATED],
+        )
+        self.assertEqual(
+            [c.data['name'] for c in UserChange.objects.filter(
+                user_id=second.id
+            )],
+            ['New', 'Newer'],
+        )
+
+    def test_compact_walks_in_batches(self):
+        """Test compacting in small batches stops at recent entries"""
+        for user in self.users:
+            user.name = 'New'
+            user.save()
+        recent = UserChange.objects.last()
+        UserChange.objects.exclude(id=recent.id).update(
+            created=timezone.now() - timedelta(days=30)
+        )
+
+        deleted = changes.compact(timedelta(days=7), batch_size=2)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(UserChange.objects.count(), 5)
+
+    def test_stream_command(self):
+        """Test the command prints each change with its cursor"""
+        out = StringIO()
+
+        call_command('stream_user_changes', stdout=out)
+
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1]['cursor'], f"default:{lines[-1]['id']}")
+
+        out = StringIO()
+        call_command(
+            'stream_user_changes', '--cursor', lines[2]['cursor'], stdout=out
+        )
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class UserChangeApiTests(TestCase):
+    """Test the user change feed API"""
+
+    def setUp(self):
+        self.user = create_user(password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_staff_only(self):
+        """Test only staff can read the feed"""
+        res = self.client.get(USER_CHANGES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_read_feed(self):
+        """Test changes and the cursor to resume are returned"""
+        self.user.is_staff = True
+        self.user.save()
+
+        res = self.client.get(USER_CHANGES_URL, {'limit': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['changes']), 1)
+        self.assertEqual(res.data['changes'][0]['action'], changes.CREATED)
+
+        res = self.client.get(USER_CHANGES_URL, {'cursor': res.data['cursor']})
+
+        self.assertEqual(res.data['changes'][0]['fields'], ['is_staff'])
+
+    def test_long_poll_times_out(self):
+        """Test a long poll with nothing new waits and returns empty"""
+        self.user.is_staff = True
+        self.user.save()
+        cursor = changes.read_changes('')[1]
+
+        with patch.object(changes._committed, 'wait') as wait:
+            res = self.client.get(
+                USER_CHANGES_URL, {'cursor': cursor, 'wait': 0.01}
+            )
+
+        self.assertEqual(res.data['changes'], [])
+        self.assertEqual(res.data['cursor'], cursor)
+        self.assertTrue(wait.called)
+
+    def test_invalid_cursor_rejected(self):
+        """Test a malformed cursor is a bad request"""
+        self.user.is_staff = True
+        self.user.save()
+
+        res = self.client.get(USER_CHANGES_URL, {'cursor': 'nope'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
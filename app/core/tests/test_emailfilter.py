@@ -0,0 +1,161 @@
+"""
+Tests for the email filter
+"""
+import uuid
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.emailfilter import BloomFilter, email_filter, rebuild_capacity
+
+CREATE_USER_URL = reverse("user:create")
+
+
+class BloomFilterTests(SimpleTestCase):
+    """Test the Bloom filter"""
+
+    def test_no_false_negatives(self):
+        """Test every added item is reported as present"""
+        bloom = BloomFilter(1000, 0.01)
+        emails = [f"user{i}@example.com" for i in range(1000)]
+        for email in emails:
+            bloom.add(email)
+
+        self.assertTrue(all(email in bloom for email in emails))
+
+    def test_false_positive_rate_near_target(self):
+        """Test a full filter stays close to its false positive target"""
+        bloom = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom.add(f"user{i}@example.com")
+
+        probes = 20000
+        false_positives = sum(
+            f"{uuid.uuid4().hex}@example.com" in bloom for _ in range(probes)
+        )
+        self.assertLess(false_positives / probes, 0.02)
+
+    def test_memory_use(self):
+        """Test memory use at 1M and 10M users for a 0.1% target"""
+        self.assertAlmostEqual(
+            BloomFilter(1_000_000, 0.001).size_bytes / 2 ** 20, 1.7, 1
+        )
+        self.assertAlmostEqual(
+            BloomFilter(10_000_000, 0.001).size_bytes / 2 ** 20, 17.1, 1
+        )
+
+    def test_rebuild_capacity_has_headroom(self):
+        """Test rebuilds leave room for more users, not double"""
+        self.assertEqual(rebuild_capacity(10_000_000), 12_000_000)
+        self.assertEqual(
+            BloomFilter(rebuild_capacity(10_000_000), 0.001).size_bytes
+            // 2 ** 20,
+            20,
+        )
+
+    def test_report_command(self):
+        """Test the report command prints memory use per size"""
+        out = StringIO()
+        with self.settings(EMAIL_FILTER_ENABLED=False):
+            call_command(
+                "email_filter_report", "--sizes", "1000000", stdout=out
+            )
+
+        self.assertIn("1,000,000 users:      2.1 MiB", out.getvalue())
+
+
+class EmailFilterTests(TestCase):
+    """Test signups use the email filter"""
+
+    def setUp(self):
+        email_filter.rebuild()
+        self.client = APIClient()
+        self.payload = {
+            "email": "test@example.com",
+            "password": "testpass123",
+            "name": "Test Name",
+        }
+
+    def test_filter_tracks_created_users(self):
+        """Test new users are added to the filter"""
+        self.assertFalse(email_filter.might_exist("test@example.com"))
+
+        get_user_model().objects.create_user("test@EXAMPLE.com", "pass1234")
+
+        self.assertTrue(email_filter.might_exist("test@example.com"))
+
+    @patch("core.sharding.email_taken")
+    def test_new_email_skips_existence_query(self, patched_email_taken):
+        """Test a definitely new email is not looked up"""
+        res = self.client.post(CREATE_USER_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        patched_email_taken.assert_not_called()
+
+    def test_known_email_rejected(self):
+        """Test an email in the filter is checked and rejected"""
+        get_user_model().objects.create_user(**self.payload)
+
+        res = self.client.post(CREATE_USER_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", res.data)
+
+    def test_unique_constraint_backs_up_filter(self):
+        """Test an email missed by the filter is still rejected"""
+        get_user_model().objects.create_user(**self.payload)
+
+        with patch.object(email_filter, "might_exist", return_value=False):
+            res = self.client.post(CREATE_USER_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", res.data)
+        self.assertEqual(get_user_model().objects.count(), 1)
+
+    def test_unbuilt_filter_might_hold_anything(self):
+        """Test every email may exist until the filter is built"""
+        email_filter.reset()
+
+        self.assertTrue(email_filter.might_exist("new@example.com"))
+
+    def test_save_without_email_change_not_added(self):
+        """Test saving a user adds its email only when it changes"""
+        user = get_user_model().objects.create_user(**self.payload)
+        count = email_filter.bloom.count
+
+        user.name = "New Name"
+        user.save()
+        self.assertEqual(email_filter.bloom.count, count)
+
+        user.email = "new@example.com"
+        user.save()
+        self.assertEqual(email_filter.bloom.count, count + 1)
+        self.assertTrue(email_filter.might_exist("new@example.com"))
+
+    def test_email_added_during_rebuild_kept(self):
+        """Test users created while the filter is rebuilt stay in it"""
+        def create_during_read():
+            get_user_model().objects.create_user(**self.payload)
+            return get_user_model().objects.none().values_list("email")
+
+        with patch(
+            "core.sharding.all_emails", side_effect=create_during_read
+        ):
+            email_filter.rebuild()
+
+        self.assertTrue(email_filter.might_exist("test@example.com"))
+
+    def test_queryset_delete_counts_towards_rebuild(self):
+        """Test users deleted in bulk count towards a rebuild"""
+        get_user_model().objects.create_user(**self.payload)
+
+        get_user_model().objects.all().delete()
+
+        self.assertEqual(email_filter._deleted, 1)
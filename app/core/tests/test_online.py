@@ -0,0 +1,170 @@
+"""
+Tests for online schema changes
+"""
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, models
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.backfills import BACKFILLS
+from core.models import BackfillProgress
+from core.online import (
+    AddIndexConcurrently,
+    AddNullableField,
+    Backfill,
+    BackfillRunner,
+)
+
+
+def column_names(table):
+    with connection.cursor() as cursor:
+        return [
+            column.name for column in
+            connection.introspection.get_table_description(cursor, table)
+        ]
+
+
+class OnlineOperationTests(TransactionTestCase):
+    """Test the online migration operations"""
+
+    def setUp(self):
+        self.state = MigrationLoader(connection).project_state()
+
+    def apply(self, operation, backwards=False):
+        new_state = self.state.clone()
+        operation.state_forwards("core", new_state)
+        with connection.schema_editor(atomic=False) as editor:
+            if backwards:
+                operation.database_backwards(
+                    "core", editor, new_state, self.state
+                )
+            else:
+                operation.database_forwards(
+                    "core", editor, self.state, new_state
+                )
+
+    def test_nullable_field_required(self):
+        """Test only nullable fields without defaults can be added"""
+        with self.assertRaises(ValueError):
+            AddNullableField("user", "nickname", models.CharField(
+                max_length=20
+            ))
+        with self.assertRaises(ValueError):
+            AddNullableField("user", "nickname", models.CharField(
+                max_length=20, null=True, default="x"
+            ))
+
+    def test_add_nullable_field(self):
+        """Test a nullable column is added and removed"""
+        operation = AddNullableField(
+            "user", "nickname", models.CharField(max_length=20, null=True)
+        )
+
+        self.apply(operation)
+        self.assertIn("nickname", column_names("core_user"))
+
+        self.apply(operation, backwards=True)
+        self.assertNotIn("nickname", column_names("core_user"))
+
+    def test_add_index_concurrently(self):
+        """Test indexes are built on databases without CONCURRENTLY too"""
+        operation = AddIndexConcurrently(
+            "user", models.Index(fields=["name"], name="core_user_name_idx")
+        )
+
+        self.apply(operation)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, "core_user"
+            )
+        self.assertIn("core_user_name_idx", constraints)
+
+        self.apply(operation, backwards=True)
+
+
+class BackfillTests(TestCase):
+    """Test batched, resumable backfills"""
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(f"user{i}@example.com")
+            for i in range(25)
+        ]
+        self.backfill = Backfill(
+            "user-name",
+            "core.User",
+            values={"name": "Unknown"},
+            condition=models.Q(name=""),
+        )
+
+    def unnamed(self):
+        return get_user_model().objects.filter(name="").count()
+
+    def test_backfill_runs_in_batches(self):
+        """Test every row is updated and progress is recorded"""
+        runner = BackfillRunner(self.backfill, batch_size=4)
+
+        with patch.object(runner.backfill, "update",
+                          wraps=runner.backfill.update) as update:
+            rows = runner.run()
+
+        self.assertEqual(rows, 25)
+        self.assertEqual(self.unnamed(), 0)
+        self.assertGreater(update.call_count, 1)
+        progress = BackfillProgress.objects.get(name="user-name")
+        self.assertTrue(progress.completed)
+        self.assertEqual(progress.last_pk, self.users[-1].pk)
+        self.assertEqual(progress.rows_done, 25)
+
+    def test_backfill_resumes(self):
+        """Test a run picks up after the last saved batch"""
+        middle = self.users[9].pk
+        BackfillProgress.objects.create(name="user-name", last_pk=middle)
+
+        rows = BackfillRunner(self.backfill, batch_size=4).run()
+
+        self.assertEqual(rows, 15)
+        self.assertEqual(self.unnamed(), 10)
+
+    @patch("core.online.time.sleep")
+    def test_backfill_backs_off_under_pressure(self, patched_sleep):
+        """Test high replication lag pauses and shrinks batches"""
+        runner = BackfillRunner(self.backfill, batch_size=8, max_lag=1.0)
+
+        with patch.object(runner, "replication_lag",
+                          side_effect=[5.0, 5.0] + [0.0] * 100):
+            runner.run()
+
+        self.assertEqual(patched_sleep.call_count, 2)
+        patched_sleep.assert_any_call(2)
+        self.assertEqual(self.unnamed(), 0)
+
+    def test_estimate_changes_nothing(self):
+        """Test a dry run estimates rows without updating them"""
+        with CaptureQueriesContext(connection) as queries:
+            estimate = BackfillRunner(self.backfill, batch_size=10).estimate()
+
+        self.assertFalse(any(
+            query["sql"].startswith("UPDATE") for query in queries
+        ))
+        self.assertEqual(estimate["windows"], 3)
+        self.assertEqual(estimate["rows"], 25)
+        self.assertEqual(self.unnamed(), 25)
+        self.assertFalse(BackfillProgress.objects.exists())
+
+    def test_backfill_command(self):
+        """Test the command runs a registered backfill"""
+        out = StringIO()
+        with patch.dict(BACKFILLS, {"user-name": self.backfill}):
+            call_command("backfill", "user-name", "--dry-run", stdout=out)
+            self.assertEqual(self.unnamed(), 25)
+
+            call_command("backfill", "user-name", stdout=out)
+
+        self.assertIn("updated 25 rows", out.getvalue())
+        self.assertEqual(self.unnamed(), 0)
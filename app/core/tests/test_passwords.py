@@ -0,0 +1,116 @@
+"""
+Tests for the breached password index
+"""
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from core.passwords import (
+    BreachedPasswordIndex,
+    BreachedPasswordValidator,
+    build_index,
+)
+
+
+class BreachedPasswordIndexTests(SimpleTestCase):
+    """Test building and searching the password index"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "passwords.idx"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_index_finds_listed_passwords(self):
+        """Test listed passwords are found and others are not"""
+        passwords = [f"secret{i}".encode() for i in range(100)]
+        count = build_index(passwords + passwords[:10], self.path)
+        index = BreachedPasswordIndex(self.path)
+
+        self.assertEqual(count, 100)
+        self.assertEqual(len(index), 100)
+        for i in range(100):
+            self.assertIn(f"secret{i}", index)
+        self.assertNotIn("secret100", index)
+        self.assertNotIn("", index)
+        index.close()
+
+    def test_index_built_in_chunks(self):
+        """Test lists bigger than a chunk are merged into one index"""
+        passwords = [f"secret{i}".encode() for i in range(50)]
+        count = build_index(passwords * 2, self.path, chunk_size=7)
+        index = BreachedPasswordIndex(self.path)
+
+        self.assertEqual(count, 50)
+        self.assertTrue(all(p.decode() in index for p in passwords))
+        index.close()
+
+    def test_not_an_index_rejected(self):
+        """Test opening a file that is not an index fails"""
+        self.path.write_bytes(b"password\n")
+
+        with self.assertRaises(ValueError):
+            BreachedPasswordIndex(self.path)
+
+    def test_validator_rejects_breached_password(self):
+        """Test the validator rejects listed passwords in any case"""
+        build_index([b"hunter22"], self.path)
+        validator = BreachedPasswordValidator(self.path)
+
+        with self.assertRaises(ValidationError):
+            validator.validate("hunter22")
+        with self.assertRaises(ValidationError):
+            validator.validate("HUNTER22")
+        validator.validate("correct-horse-battery")
+
+    def test_validator_skipped_without_index(self):
+        """Test a missing index is logged and the check skipped"""
+        validator = BreachedPasswordValidator(self.path)
+
+        with self.assertLogs("core.passwords", "WARNING"):
+            validator.validate("password")
+        self.assertFalse(hasattr(validator, "_fallback"))
+
+    @patch("core.passwords.INDEX_RECHECK_INTERVAL", 0)
+    def test_validator_picks_up_new_index(self):
+        """Test an index built after the first check is used"""
+        validator = BreachedPasswordValidator(self.path)
+        validator.validate("correct-horse-battery")
+
+        build_index([b"correct-horse-battery"], self.path)
+
+        with self.assertRaises(ValidationError):
+            validator.validate("correct-horse-battery")
+
+    @patch("core.passwords.INDEX_RECHECK_INTERVAL", 0)
+    def test_validator_picks_up_rebuilt_index(self):
+        """Test a rebuilt index replaces the one already open"""
+        build_index([b"hunter22"], self.path)
+        validator = BreachedPasswordValidator(self.path)
+        validator.validate("letmein99")
+
+        build_index([b"hunter22", b"letmein99"], self.path)
+
+        with self.assertRaises(ValidationError):
+            validator.validate("letmein99")
+
+    def test_build_password_index_command(self):
+        """Test the command indexes a plain text list"""
+        source = Path(self.tmp.name) / "passwords.txt"
+        source.write_text("hunter22\nletmein99\n\n")
+
+        call_command(
+            "build_password_index", str(source),
+            "--output", str(self.path), stdout=StringIO(),
+        )
+
+        index = BreachedPasswordIndex(self.path)
+        self.assertEqual(len(index), 2)
+        self.assertIn("letmein99", index)
+        index.close()
@@ -0,0 +1,124 @@
+"""
+Tests for on-demand request profiling
+"""
+import tempfile
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+
+from core.models import RequestProfile
+from core.profiling import sign_profile_request
+
+CREATE_USER_URL = reverse("user:create")
+ME_URL = reverse("user:me")
+
+
+class RequestProfilingTests(TestCase):
+    """Test profiling is triggered on demand and viewable in the admin"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(
+            REQUEST_PROFILE_DIR=self.tmp.name
+        )
+        self.settings_override.enable()
+
+        self.admin_user = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="Pa55w0rd!",
+        )
+        self.client = Client()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp.cleanup()
+
+    def test_unrequested_request_not_profiled(self):
+        """Test requests are not profiled unless asked"""
+        self.client.force_login(self.admin_user)
+        res = self.client.get(reverse("admin:core_user_changelist"))
+
+        self.assertNotIn("X-Profile", res)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_can_profile_admin_page(self):
+        """Test staff profile a page with the query parameter"""
+        self.client.force_login(self.admin_user)
+        url = reverse("admin:core_user_changelist")
+        res = self.client.get(url, {"_profile": "1"})
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(res["X-Profile"], str(profile.pk))
+        self.assertEqual(profile.path, url)
+        self.assertEqual(profile.user_email, self.admin_user.email)
+        self.assertGreater(profile.query_count, 0)
+        self.assertIn("Slowest queries:", profile.summary)
+        self.assertTrue(Path(profile.stacks_file).exists())
+
+    def test_staff_token_can_profile_api_request(self):
+        """Test staff calling the API with a token profile with the header"""
+        token = Token.objects.create(user=self.admin_user)
+        res = self.client.patch(
+            ME_URL, {"name": "Admin"}, content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token.key}", HTTP_X_PROFILE="1",
+        )
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(res["X-Profile"], str(profile.pk))
+        self.assertEqual(profile.method, "PATCH")
+        self.assertEqual(profile.user_email, self.admin_user.email)
+
+    def test_anonymous_header_without_signature_ignored(self):
+        """Test anonymous callers cannot profile with a plain header"""
+        self.client.post(CREATE_USER_URL, {}, HTTP_X_PROFILE="1")
+
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_signed_header_profiles_request(self):
+        """Test a signed header lets any caller profile a request"""
+        payload = {"email": "test@example.com", "password": "testpass123"}
+        res = self.client.post(
+            CREATE_USER_URL, payload, HTTP_X_PROFILE=sign_profile_request(),
+        )
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(res["X-Profile"], str(profile.pk))
+        self.assertEqual(profile.method, "POST")
+        self.assertEqual(profile.status, res.status_code)
+
+    def test_busy_when_no_profile_slot_free(self):
+        """Test the per process cap skips profiling when reached"""
+        with self.settings(REQUEST_PROFILE_MAX_CONCURRENT=0):
+            client = Client()
+            client.force_login(self.admin_user)
+            res = client.get(
+                reverse("admin:core_user_changelist"), {"_profile": "1"}
+            )
+
+        self.assertEqual(res["X-Profile"], "busy")
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_profile_viewable_in_admin(self):
+        """Test the profile page and stacks download work"""
+        self.client.force_login(self.admin_user)
+        self.client.get(
+            reverse("admin:core_user_changelist"), {"_profile": "1"}
+        )
+        profile = RequestProfile.objects.get()
+
+        res = self.client.get(
+            reverse("admin:core_requestprofile_change", args=[profile.pk])
+        )
+        self.assertContains(res, "Slowest queries:")
+
+        res = self.client.get(
+            reverse("admin:core_requestprofile_stacks", args=[profile.pk])
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            b"".join(res.streaming_content),
+            Path(profile.stacks_file).read_bytes(),
+        )
@@ -0,0 +1,235 @@
+"""
+Tests for user sharding
+
+The database tests need several shards. Run this module on its own in
+that mode, as the other suites expect a single user database:
+
+    DB_SHARDS=users1,users2 DB_SHARD_ENGINE=sqlite \
+        python manage.py test core.tests.test_sharding
+"""
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core import changes, sharding
+from core.backends import ShardedTokenAuthentication
+from core.models import UserChange, UserShard
+
+SHARDS = ["default", "users1", "users2"]
+
+
+@override_settings(USER_SHARDS=SHARDS)
+class ShardPlacementTests(SimpleTestCase):
+    """Test users are placed on shards by a stable hash"""
+
+    def test_pick_shard_is_stable(self):
+        """Test the same email always picks the same shard"""
+        first = sharding.pick_shard("test@example.com")
+
+        for _ in range(5):
+            self.assertEqual(sharding.pick_shard("test@example.com"), first)
+        self.assertIn(first, SHARDS)
+
+    def test_pick_shard_uses_normalized_email(self):
+        """Test emails differing only in domain case share a shard"""
+        self.assertEqual(
+            sharding.pick_shard("test@EXAMPLE.com"),
+            sharding.pick_shard("test@example.com"),
+        )
+
+    def test_users_spread_across_shards(self):
+        """Test every shard gets a fair share of users"""
+        counts = dict.fromkeys(SHARDS, 0)
+        for i in range(3000):
+            counts[sharding.pick_shard(f"user{i}@example.com")] += 1
+
+        for count in counts.values():
+            self.assertGreater(count, 800)
+
+    def test_adding_shard_only_moves_users_to_it(self):
+        """Test growing the shard list never shuffles existing shards"""
+        grown = SHARDS + ["users3"]
+        for i in range(1000):
+            email = f"user{i}@example.com"
+            before = sharding.pick_shard(email, SHARDS)
+            after = sharding.pick_shard(email, grown)
+            self.assertIn(after, (before, "users3"))
+
+    @override_settings(USER_SHARDS=["default"])
+    def test_single_shard_is_not_sharded(self):
+        """Test a single database keeps sharding switched off"""
+        self.assertFalse(sharding.is_sharded())
+        self.assertEqual(sharding.locate_user(1), "default")
+
+
+@skipUnless(len(settings.USER_SHARDS) > 1, "Needs at least two shards")
+class ShardedUserTests(TestCase):
+    """Test creating, finding and moving users across shards"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        # Ids are reused once a test rolls back, so drop cached lookups
+        cache.clear()
+
+    def create_user(self, email, password="testpass123"):
+        return sharding.create_user(email=email, password=password)
+
+    def test_create_user_on_picked_shard(self):
+        """Test a new user is stored on its shard with a directory entry"""
+        email = "test@example.com"
+        user = self.create_user(email)
+
+        shard = sharding.pick_shard(email)
+        self.assertEqual(user._state.db, shard)
+        self.assertTrue(
+            get_user_model().objects.using(shard).filter(pk=user.pk).exists()
+        )
+        self.assertEqual(sharding.locate_user(user.pk), shard)
+
+    def test_user_ids_unique_across_shards(self):
+        """Test ids do not collide between shards"""
+        users = [self.create_user(f"user{i}@example.com") for i in range(20)]
+
+        self.assertGreater(len({user._state.db for user in users}), 1)
+        self.assertEqual(len({user.pk for user in users}), len(users))
+
+    def test_duplicate_email_rejected_across_shards(self):
+        """Test an email can only be registered once"""
+        self.create_user("test@example.com")
+
+        self.assertTrue(sharding.email_taken("test@example.com"))
+        with self.assertRaises(Exception):
+            self.create_user("test@example.com")
+
+    def test_authenticate_finds_user_on_shard(self):
+        """Test logging in finds users wherever they live"""
+        user = self.create_user("test@example.com", "goodpass")
+
+        self.assertEqual(
+            authenticate(username="test@example.com", password="goodpass"),
+            user,
+        )
+        self.assertIsNone(
+            authenticate(username="test@example.com", password="badpass")
+        )
+        self.assertIsNone(
+            authenticate(username="nobody@example.com", password="goodpass")
+        )
+
+    def test_token_authentication_finds_token_on_shard(self):
+        """Test tokens are looked up on every shard"""
+        user = self.create_user("test@example.com")
+        token = Token.objects.using(user._state.db).create(user=user)
+
+        found_user, found_token = (
+            ShardedTokenAuthentication().authenticate_credentials(token.key)
+        )
+        self.assertEqual(found_user, user)
+
+    def test_delete_user_releases_email(self):
+        """Test deleting a user frees its directory entry"""
+        user = self.create_user("test@example.com")
+        user.delete()
+
+        self.assertFalse(sharding.email_taken("test@example.com"))
+
+    def test_queryset_delete_releases_email(self):
+        """Test bulk deletes, as the admin makes, free directory entries"""
+        user = self.create_user("test@example.com")
+
+        get_user_model().objects.using(user._state.db).filter(
+            pk=user.pk
+        ).delete()
+
+        self.assertFalse(UserShard.objects.filter(pk=user.pk).exists())
+        self.assertFalse(sharding.email_taken("test@example.com"))
+
+    def test_move_user(self):
+        """Test moving a user keeps its id, password and token"""
+        user = self.create_user("test@example.com", "goodpass")
+        token = Token.objects.using(user._state.db).create(user=user)
+        source = user._state.db
+        target = next(s for s in sharding.get_shards() if s != source)
+
+        self.assertTrue(sharding.move_user(user.pk, target))
+
+        moved = sharding.get_user(user.pk)
+        self.assertEqual(moved._state.db, target)
+        self.assertTrue(moved.check_password("goodpass"))
+        self.assertTrue(
+            Token.objects.using(target).filter(key=token.key).exists()
+        )
+        self.assertFalse(
+            get_user_model().objects.using(source).filter(
+                pk=user.pk
+            ).exists()
+        )
+        self.assertEqual(sharding.locate_user(user.pk), target)
+        # The user lives on, so the move records no delete
+        self.assertFalse(
+            UserChange.objects.using(source).filter(
+                action=changes.DELETED
+            ).exists()
+        )
+
+    def test_save_after_move_does_not_recreate_user(self):
+        """Test saving a copy loaded before a move fails on the old shard"""
+        user = self.create_user("test@example.com")
+        source = user._state.db
+        target = next(s for s in sharding.get_shards() if s != source)
+        sharding.move_user(user.pk, target)
+
+        user.name = "Late"
+        with self.assertRaises(DatabaseError):
+            user.save()
+
+        self.assertFalse(
+            get_user_model().objects.using(source).filter(
+                pk=user.pk
+            ).exists()
+        )
+        self.assertEqual(sharding.get_user(user.pk)._state.db, target)
+
+    def test_stale_cached_shard_rechecked(self):
+        """Test a shard cached by another process before a move is retried"""
+        user = self.create_user("test@example.com", "goodpass")
+        source = user._state.db
+        target = next(s for s in sharding.get_shards() if s != source)
+        sharding.move_user(user.pk, target)
+        # As left in the local cache of a process that did not move it
+        cache.set(sharding._id_key(user.pk), source)
+        cache.set(sharding._email_key(user.email), source)
+
+        self.assertEqual(sharding.get_user(user.pk)._state.db, target)
+        self.assertEqual(
+            authenticate(email="test@example.com", password="goodpass"),
+            user,
+        )
+        self.assertEqual(sharding.locate_user(user.pk), target)
+
+    def test_rebalance_moves_misplaced_users(self):
+        """Test the rebalance command puts users back on their shard"""
+        user = self.create_user("test@example.com")
+        home = user._state.db
+        away = next(s for s in sharding.get_shards() if s != home)
+        sharding.move_user(user.pk, away)
+
+        call_command(
+            "rebalance_user_shards", "--dry-run", stdout=StringIO()
+        )
+        self.assertEqual(sharding.locate_user(user.pk), away)
+
+        call_command("rebalance_user_shards", stdout=StringIO())
+        self.assertEqual(sharding.locate_user(user.pk), home)
+        self.assertEqual(
+            UserShard.objects.filter(pk=user.pk).get().shard, home
+        )
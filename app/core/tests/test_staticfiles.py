@@ -0,0 +1,143 @@
+"""
+Tests for collecting and serving static files
+"""
+import gzip
+import tempfile
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core.staticfiles import (
+    IMMUTABLE_CACHE_CONTROL,
+    StaticFilesMiddleware,
+    negotiate,
+)
+
+CSS = "body { color: #333; }\n" * 50
+
+
+class NegotiateTests(SimpleTestCase):
+    """Test choosing a content encoding"""
+
+    available = {"identity": None, "gzip": None, "br": None}
+
+    def test_prefers_brotli(self):
+        """Test brotli is preferred when accepted as much as gzip"""
+        self.assertEqual(negotiate("gzip, deflate, br", self.available), "br")
+        self.assertEqual(negotiate("*", self.available), "br")
+
+    def test_quality_values(self):
+        """Test q-values rank the codings and q=0 refuses them"""
+        self.assertEqual(
+            negotiate("br;q=0.5, gzip;q=0.8", self.available), "gzip"
+        )
+        self.assertEqual(negotiate("br;q=0, gzip", self.available), "gzip")
+        self.assertEqual(
+            negotiate("gzip;q=0.5, identity", self.available), "identity"
+        )
+
+    def test_identity_fallback(self):
+        """Test identity is served when nothing else is accepted"""
+        self.assertEqual(negotiate(None, self.available), "identity")
+        self.assertEqual(negotiate("deflate", self.available), "identity")
+        self.assertEqual(negotiate("br", {"identity": None}), "identity")
+
+
+class StaticFilesTests(SimpleTestCase):
+    """Test collectstatic and the static files middleware"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        source = Path(self.tmp.name) / "source"
+        (source / "css").mkdir(parents=True)
+        (source / "css" / "site.css").write_text(CSS)
+        (source / "tiny.txt").write_text("tiny")
+
+        settings = override_settings(
+            STATIC_ROOT=str(Path(self.tmp.name) / "root"),
+            STATICFILES_DIRS=[str(source)],
+            STATICFILES_FINDERS=[
+                "django.contrib.staticfiles.finders.FileSystemFinder",
+            ],
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(self.tmp.cleanup)
+
+        call_command("collectstatic", "--noinput", verbosity=0)
+        self.root = Path(self.tmp.name) / "root"
+        self.css_name = staticfiles_storage.stored_name("css/site.css")
+        self.css_url = staticfiles_storage.url("css/site.css")
+        self.middleware = StaticFilesMiddleware(
+            lambda request: HttpResponse("app")
+        )
+        self.factory = RequestFactory()
+
+    def test_collect_hashes_and_compresses(self):
+        """Test files are stored hashed with compressed copies"""
+        self.assertNotEqual(self.css_name, "css/site.css")
+        compressed = (self.root / f"{self.css_name}.gz").read_bytes()
+        self.assertEqual(gzip.decompress(compressed).decode(), CSS)
+        self.assertFalse((self.root / "tiny.txt.gz").exists())
+
+    def test_serves_hashed_file_forever(self):
+        """Test hashed files are served with far future caching"""
+        res = self.middleware(self.factory.get(self.css_url))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b"".join(res.streaming_content).decode(), CSS)
+        self.assertEqual(res["Cache-Control"], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(res["Content-Type"], "text/css; charset=utf-8")
+        self.assertEqual(res["Vary"], "Accept-Encoding")
+        self.assertNotIn("Content-Encoding", res)
+        res.close()
+
+    def test_serves_compressed_variant(self):
+        """Test an accepted compressed variant is served"""
+        res = self.middleware(
+            self.factory.get(self.css_url, HTTP_ACCEPT_ENCODING="gzip")
+        )
+
+        self.assertEqual(res["Content-Encoding"], "gzip")
+        body = gzip.decompress(b"".join(res.streaming_content))
+        self.assertEqual(body.decode(), CSS)
+        self.assertEqual(int(res["Content-Length"]), len(gzip.compress(
+            CSS.encode(), compresslevel=9, mtime=0
+        )))
+        res.close()
+
+    def test_conditional_request(self):
+        """Test a matching ETag is answered with 304"""
+        request = self.factory.get(self.css_url, HTTP_ACCEPT_ENCODING="gzip")
+        etag = self.middleware(request)["ETag"]
+
+        res = self.middleware(self.factory.get(
+            self.css_url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag
+        ))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res["ETag"], etag)
+
+    def test_head_request(self):
+        """Test HEAD returns the headers without a body"""
+        res = self.middleware(self.factory.head(self.css_url))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, b"")
+        self.assertEqual(int(res["Content-Length"]), len(CSS))
+
+    def test_other_paths_passed_on(self):
+        """Test unknown files and other paths reach the application"""
+        for path in ["/static/missing.css", "/api/user/me/"]:
+            res = self.middleware(self.factory.get(path))
+            self.assertEqual(res.content, b"app")
+
+    def test_not_used_in_debug(self):
+        """Test runserver keeps serving static files in development"""
+        with override_settings(DEBUG=True):
+            with self.assertRaises(MiddlewareNotUsed):
+                StaticFilesMiddleware(lambda request: HttpResponse())
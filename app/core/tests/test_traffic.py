@@ -0,0 +1,134 @@
+"""
+Tests for traffic capture and replay
+"""
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import traffic
+
+
+class TrafficShapeTests(SimpleTestCase):
+    """Test bodies are reduced to shapes without their values"""
+
+    def test_value_shape_redacts_secrets(self):
+        """Test secret fields are dropped and others keep only their type"""
+        shape = traffic.value_shape({
+            "email": "test@example.com",
+            "password": "testpass123",
+            "age": 3,
+            "tags": ["a"],
+        })
+
+        self.assertEqual(shape, {
+            "email": "str:16",
+            "password": traffic.REDACTED,
+            "age": "int",
+            "tags": ["str:1"],
+        })
+
+    def test_fill_shape(self):
+        """Test a shape is filled with known fields and placeholders"""
+        body = traffic.fill_shape(
+            {"email": "str:16", "password": traffic.REDACTED, "name": "str:4"},
+            {"email": "a@example.com", "password": "pw"},
+        )
+
+        self.assertEqual(body, {
+            "email": "a@example.com", "password": "pw", "name": "xxxx",
+        })
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+
+        self.assertEqual(traffic.percentile(values, 50), 50)
+        self.assertEqual(traffic.percentile(values, 99), 99)
+        self.assertEqual(traffic.percentile([], 50), 0.0)
+
+    def test_capture_path_per_process(self):
+        """Test each process gets its own capture file"""
+        self.assertEqual(
+            traffic.capture_path("/tmp/capture.jsonl", pid=42),
+            Path("/tmp/capture.42.jsonl"),
+        )
+
+
+class TrafficCaptureTests(TestCase):
+    """Test the capture middleware"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture = Path(self.tmp.name) / "capture.jsonl"
+        self.written = traffic.capture_path(self.capture)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_capture_records_anonymized_trace(self):
+        """Test a sampled request is recorded without its secrets"""
+        payload = {
+            "email": "test@example.com",
+            "password": "testpass123",
+            "name": "Test Name",
+        }
+        with self.settings(
+            TRAFFIC_CAPTURE_RATE=1, TRAFFIC_CAPTURE_FILE=self.capture
+        ):
+            APIClient().post(reverse("user:create"), payload, format="json")
+
+        contents = self.written.read_text()
+        self.assertNotIn("test@example.com", contents)
+        self.assertNotIn("testpass123", contents)
+
+        trace = json.loads(contents)
+        self.assertEqual(trace["method"], "POST")
+        self.assertEqual(trace["url_name"], "user:create")
+        self.assertEqual(trace["status"], 201)
+        self.assertEqual(trace["body"]["password"], traffic.REDACTED)
+
+    @override_settings(TRAFFIC_CAPTURE_RATE=0)
+    def test_capture_off_by_default(self):
+        """Test nothing is recorded when the rate is zero"""
+        with self.settings(TRAFFIC_CAPTURE_FILE=self.capture):
+            APIClient().get(reverse("user:me"))
+
+        self.assertFalse(self.written.exists())
+
+
+class ReplayCommandTests(SimpleTestCase):
+    """Test the replay command"""
+
+    @patch("core.management.commands.replay_traffic.urlopen")
+    def test_replay_reports_latency_per_endpoint(self, patched_urlopen):
+        """Test every trace is sent and reported under its endpoint"""
+        response = MagicMock(status=200)
+        response.read.return_value = b'{"token": "abc"}'
+        patched_urlopen.return_value.__enter__.return_value = response
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as capture:
+            for ts in range(3):
+                capture.write(json.dumps({
+                    "ts": ts, "method": "GET", "url_name": "user:me",
+                    "kwargs": {}, "auth": True, "body": None,
+                }) + "\n")
+            capture.flush()
+
+            out = StringIO()
+            call_command(
+                "replay_traffic", capture.name, "--speed", "0", stdout=out
+            )
+
+        # Two calls to log in, then one per trace
+        self.assertEqual(patched_urlopen.call_count, 5)
+        request = patched_urlopen.call_args[0][0]
+        self.assertEqual(request.get_header("Authorization"), "Token abc")
+        self.assertIn("GET user:me: n=3 errors=0", out.getvalue())
@@ -0,0 +1,172 @@
+"""
+Capture of anonymized request traces for load test replay.
+
+A sample of requests (settings.TRAFFIC_CAPTURE_RATE) is written as JSON
+lines to a rotating file per worker process, named after
+settings.TRAFFIC_CAPTURE_FILE with the process id added, as processes
+sharing one rotating file would rotate it under each other. Each trace
+keeps what replay needs to rebuild a similar request: the method, the URL
+name and its kwargs, whether the caller was authenticated, the shape of
+the body and the timing. Header values and body contents are never
+stored, and secret fields such as passwords are dropped even from the
+shape.
+"""
+import json
+import logging
+import os
+import random
+import re
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import QueryDict
+
+REDACTED = "[redacted]"
+
+SECRET_FIELD = re.compile(r"pass|token|secret|key|auth", re.IGNORECASE)
+
+# Bodies larger than this are not read just to record their shape
+MAX_BODY_BYTES = 64 * 1024
+
+
+def value_shape(value):
+    """Return a description of a value that does not reveal it."""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if SECRET_FIELD.search(key) else value_shape(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [value_shape(item) for item in value]
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return type(value).__name__
+    if value is None:
+        return "null"
+    return f"str:{len(str(value))}"
+
+
+def body_shape(request):
+    """Return the shape of a request body, or None if it has none."""
+    content_type = request.content_type or ""
+    length = int(request.META.get("CONTENT_LENGTH") or 0)
+    if not length or length > MAX_BODY_BYTES:
+        return None
+
+    if content_type == "application/json":
+        try:
+            return value_shape(json.loads(request.body))
+        except ValueError:
+            return None
+    if content_type == "application/x-www-form-urlencoded":
+        return value_shape(QueryDict(request.body).dict())
+    if content_type == "multipart/form-data":
+        return value_shape(request.POST.dict())
+    return None
+
+
+def make_trace(request, response, started, duration):
+    """Build the trace recorded for a finished request."""
+    match = request.resolver_match
+    return {
+        "ts": round(started, 6),
+        "method": request.method,
+        "url_name": match.view_name if match else None,
+        "kwargs": match.kwargs if match else {},
+        "auth": "HTTP_AUTHORIZATION" in request.META,
+        "content_type": request.content_type,
+        "body": getattr(request, "_traffic_body", None),
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 3),
+    }
+
+
+def fill_shape(shape, fields):
+    """Return a body matching a recorded shape.
+
+    Keys found in fields take their value from it, everything else gets a
+    placeholder of the recorded type and length.
+    """
+    if isinstance(shape, dict):
+        return {
+            key: fields[key] if key in fields else fill_shape(item, fields)
+            for key, item in shape.items()
+        }
+    if isinstance(shape, list):
+        return [fill_shape(item, fields) for item in shape]
+    if shape == "bool":
+        return True
+    if shape == "int":
+        return 1
+    if shape == "float":
+        return 1.0
+    if shape == "null":
+        return None
+    if isinstance(shape, str) and shape.startswith("str:"):
+        return "x" * int(shape[4:])
+    return ""
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def capture_path(path, pid=None):
+    """Return the capture file of a process for the configured path."""
+    path = Path(path)
+    pid = os.getpid() if pid is None else pid
+    return path.with_name(f"{path.stem}.{pid}{path.suffix}")
+
+
+def read_capture(path):
+    """Yield the traces stored in a capture file, oldest first."""
+    with open(path) as capture:
+        for line in capture:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class TrafficCaptureMiddleware:
+    """Record a sample of requests to a rotating capture file"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rate = getattr(settings, "TRAFFIC_CAPTURE_RATE", 0)
+        if not self.rate:
+            raise MiddlewareNotUsed
+
+        path = capture_path(settings.TRAFFIC_CAPTURE_FILE)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.handler = RotatingFileHandler(
+            path,
+            maxBytes=settings.TRAFFIC_CAPTURE_MAX_BYTES,
+            backupCount=settings.TRAFFIC_CAPTURE_BACKUP_COUNT,
+        )
+
+    def __call__(self, request):
+        if random.random() >= self.rate:
+            return self.get_response(request)
+
+        # Read the body shape up front, views may consume the stream
+        request._traffic_body = body_shape(request)
+        started = time.time()
+        timer = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - timer
+
+        self.write(make_trace(request, response, started, duration))
+        return response
+
+    def write(self, trace):
+        """Append a trace to the capture file, rotating it when full."""
+        record = logging.makeLogRecord({"msg": json.dumps(trace)})
+        self.handler.handle(record)
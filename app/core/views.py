@@ -0,0 +1,74 @@
+"""
+Views for the core app.
+"""
+from rest_framework import authentication, generics, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.backends import ShardedTokenAuthentication
+from core.batch import run_batch
+from core.cache import cache_stats
+from core.changes import wait_for_changes
+from core.serializers import (
+    BatchSerializer,
+    UserChangeQuerySerializer,
+    UserChangeSerializer,
+)
+
+
+class CacheStatsView(APIView):
+    """Report cache hit ratios and latencies of this process"""
+    authentication_classes = [
+        ShardedTokenAuthentication,
+        authentication.SessionAuthentication,
+    ]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """Return hits, misses and mean latency per namespace and tier"""
+        return Response(cache_stats())
+
+
+class BatchView(generics.GenericAPIView):
+    """Run a batch of user API requests in one round trip"""
+    serializer_class = BatchSerializer
+    authentication_classes = [
+        ShardedTokenAuthentication,
+        authentication.SessionAuthentication,
+    ]
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        """Return the status and body of each request in the batch"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(run_batch(
+            request,
+            serializer.validated_data['requests'],
+            atomic=serializer.validated_data['atomic'],
+        ))
+
+
+class UserChangesView(APIView):
+    """Follow changes to users from a cursor, long polling if asked"""
+    authentication_classes = [
+        ShardedTokenAuthentication,
+        authentication.SessionAuthentication,
+    ]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """Return the changes after the cursor and the cursor to resume"""
+        query = UserChangeQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        changes, cursor = wait_for_changes(
+            query.validated_data['cursor'],
+            query.validated_data['limit'],
+            timeout=query.validated_data['wait'],
+        )
+        return Response({
+            'changes': UserChangeSerializer(
+                [change for change, _ in changes], many=True
+            ).data,
+            'cursor': cursor,
+        })
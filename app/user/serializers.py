@@ -1,14 +1,23 @@
 """
 Serializers for the user API View
 """
+from contextlib import contextmanager
+from copy import copy
+
 from django.contrib.auth import (
     get_user_model,
     authenticate,
 )
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
 from django.utils.translation import gettext as _
 
 from rest_framework import serializers
 
+from core import sharding
+from core.emailfilter import email_filter
+
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for the user object"""
@@ -16,11 +25,62 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ['email', 'password', 'name']
-        extra_kwargs = {'password': {'write_only': True, 'min_length': 5}}
+        extra_kwargs = {
+            'password': {'write_only': True, 'min_length': 5},
+            # Uniqueness is checked in validate_email instead
+            'email': {'validators': []},
+        }
+
+    def validate_email(self, value):
+        """Check no other user has the email"""
+        if self.instance is not None and value == self.instance.email:
+            return value
+        # The filter lets most new emails skip the existence query, and
+        # when sharded the directory covers emails on every shard
+        if email_filter.might_exist(value) and sharding.email_taken(value):
+            raise serializers.ValidationError(
+                _('user with this email already exists.'),
+                code='unique',
+            )
+        return value
+
+    def validate(self, attrs):
+        """Check the password against the configured password policy"""
+        password = attrs.get('password')
+        if password:
+            # Similarity checks compare against the user as it will be
+            user = copy(self.instance) if self.instance else (
+                get_user_model()()
+            )
+            for field, value in attrs.items():
+                if field != 'password':
+                    setattr(user, field, value)
+            try:
+                validate_password(password, user)
+            except DjangoValidationError as error:
+                raise serializers.ValidationError(
+                    {'password': list(error.messages)}
+                )
+        return attrs
+
+    @contextmanager
+    def unique_email(self):
+        """Report a taken email found while saving as a validation error"""
+        # The unique constraint backs up the filter, so a clash can still
+        # surface here when another process created the user first
+        try:
+            with transaction.atomic():
+                yield
+        except IntegrityError:
+            raise serializers.ValidationError(
+                {'email': [_('user with this email already exists.')]},
+                code='unique',
+            )
 
     def create(self, validated_data):
         """Create and return a user with encrypted password"""
-        return get_user_model().objects.create_user(**validated_data)
+        with self.unique_email():
+            return get_user_model().objects.create_user(**validated_data)
 
     def update(self, instance, validated_data):
         """Update and return user"""
@@ -29,7 +89,8 @@ class UserSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password', None)
 
         # Use the parent class update method to update the user
-        user = super().update(instance, validated_data)
+        with self.unique_email():
+            user = super().update(instance, validated_data)
 
         # Handle password update ourselves
         if password:
@@ -1,8 +1,14 @@
 """
 Tests for the user API
 """
+import tempfile
+from io import StringIO
+from pathlib import Path
+
 from django.test import TestCase
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.urls import reverse
 
 from rest_framework.test import APIClient
@@ -72,6 +78,19 @@ class PublicUserApiTests(TestCase):
         # Check the return code was bad request
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_user_with_email_differing_in_domain_case_error(self):
+        """Test error returned if the normalized email already exists"""
+        create_user(email='test@example.com', password='testpass123')
+
+        payload = {
+            'email': 'test@EXAMPLE.com',
+            'password': 'testpass123',
+            'name': 'Test Name',
+        }
+        res = self.client.post(CREATE_USER_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_password_too_short_error(self):
         """Test an error is thrown for password under 5 characters"""
         payload = {
@@ -94,6 +113,36 @@ class PublicUserApiTests(TestCase):
         # Ensure the user doesn't exist
         self.assertFalse(user_exists)
 
+    def test_password_fails_policy_error(self):
+        """Test an error is thrown for passwords the validators reject"""
+        with tempfile.TemporaryDirectory() as tmp:
+            index = Path(tmp) / 'breached-passwords.idx'
+            call_command(
+                'build_password_index', '--output', str(index),
+                stdout=StringIO(),
+            )
+            # Validators are built once, so list them again to use the index
+            validators = [
+                dict(validator, OPTIONS={'index_path': index})
+                if validator['NAME'].endswith('BreachedPasswordValidator')
+                else validator
+                for validator in settings.AUTH_PASSWORD_VALIDATORS
+            ]
+            with self.settings(AUTH_PASSWORD_VALIDATORS=validators):
+                for password in ['password', '12345678', 'test@example.com']:
+                    payload = {
+                        'email': 'test@example.com',
+                        'password': password,
+                        'name': 'Test Name',
+                    }
+                    res = self.client.post(CREATE_USER_URL, payload)
+
+                    self.assertEqual(
+                        res.status_code, status.HTTP_400_BAD_REQUEST
+                    )
+                    self.assertIn('password', res.data)
+        self.assertFalse(get_user_model().objects.exists())
+
     def test_create_token_for_user(self):
         """Test generate token for valid credentials"""
         # Create a user object for an existing user
@@ -1,11 +1,15 @@
 """
 Views for the user API.
 """
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core.backends import ShardedTokenAuthentication
+
 from user.serializers import (
     UserSerializer,
     AuthTokenSerializer,
@@ -22,6 +26,16 @@ class CreateTokenView(ObtainAuthToken):
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """Return the user's token, creating it on the user's shard"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.using(
+            user._state.db
+        ).get_or_create(user=user)
+        return Response({'token': token.key})
+
 
 # RetrieveUpdateAPIView is used to get and update form the db
 # Supports GET, PATCH, PUT
@@ -30,7 +44,7 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     # Same user serializer as we are usign the same model
     serializer_class = UserSerializer
     # Checking the authentication is valid
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [ShardedTokenAuthentication]
     # Permissions, check what the user can do
     permission_classes = [permissions.IsAuthenticated]
 